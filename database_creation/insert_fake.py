@@ -1,32 +1,28 @@
-import sqlite3
+import argparse
+import bisect
+import itertools
 import random
+import sqlite3
+import time
+
+import setup
 
-# Connect to database
-conn = sqlite3.connect("fake.db")
-cursor = conn.cursor()
-
-# Reset tables
-cursor.executescript("""
-DROP TABLE IF EXISTS Manufacturer;
-DROP TABLE IF EXISTS NBDrugs;
-DROP TABLE IF EXISTS Disease;
-DROP TABLE IF EXISTS Generics;
-DROP TABLE IF EXISTS DrugAlt;
-DROP TABLE IF EXISTS Treatment;
-
-CREATE TABLE Manufacturer(ManID int, Name text);
-CREATE TABLE NBDrugs(DrugID int, Name text, Price int, Purpose text, ManID int);
-CREATE TABLE Disease(DiseaseID int, Name text);
-CREATE TABLE Generics(GenID int, Name text, Price int, Purpose text);
-CREATE TABLE DrugAlt(DrugID int, GenID int);
-CREATE TABLE Treatment(DiseaseID int, DrugID int);
-""")
+#TO RUN (small database like the original fake.db):
+#python3 insert_fake.py --db ../server/fake.db
+
+#TO RUN at production scale, same seed gives the same database every time:
+#python3 insert_fake.py --db big.db --drugs 1000000 --generics 1500000 --diseases 5000 --seed 7
 
 # Sample data
-manufacturers = ["PharmaCorp", "MediLife", "HealWell", "BioGen", "CureTech"]
 purposes = ["Pain Relief", "Antibiotic", "Anti-inflammatory", "Antiviral", "Blood Pressure"]
 diseases = ["Flu", "Cold", "Arthritis", "Hypertension", "Infection", "COVID-19"]
 
+manufacturer_names = ["PharmaCorp", "MediLife", "HealWell", "BioGen", "CureTech"]
+manufacturer_suffixes = ["Labs", "Pharma", "Therapeutics", "Health", "Biosciences"]
+
+disease_qualifiers = ["Acute", "Chronic", "Juvenile", "Viral", "Bacterial", "Allergic", "Seasonal",
+                      "Hereditary", "Recurrent", "Severe"]
+
 prefixes = [
     "Abr", "Acu", "Ben", "Cetra", "Dolo", "Exo", "Flora", "Geno", "Hema", "Immu", "Juvo",
     "Ketra", "Luma", "Myco", "Neuro", "Ortho", "Pedi", "Quanta", "Rena", "Sero", "Thera",
@@ -48,48 +44,140 @@ suffixes = [
 ]
 
 
-def generate_drug_name(existing_names):
+def drug_names(rng):
+    #every prefix/suffix pair in a seeded order, then the same pairs numbered 2, 3, ...
+    #so names are unique without retrying random picks
+    pairs = [p + s for p, s in itertools.product(dict.fromkeys(prefixes), suffixes)]
+    rng.shuffle(pairs)
+    seen = set()
+    for round_no in itertools.count(1):
+        for pair in pairs:
+            name = pair if round_no == 1 else f"{pair} {round_no}"
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+
+def numbered(names, extras):
+    #the listed names first, then every extra combined with them, then numbered copies
+    yield from names
+    for extra in extras:
+        for name in names:
+            yield f"{extra} {name}"
+    for round_no in itertools.count(2):
+        for name in names:
+            yield f"{name} {round_no}"
+
+
+def zipf_cum_weights(n, s):
+    #rank k is picked with probability proportional to 1 / k^s
+    return list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+
+def zipf_sample(rng, cum_weights, k):
+    #k distinct 1-based ranks, popular ranks first in line
+    total = cum_weights[-1]
+    picked = set()
+    while len(picked) < min(k, len(cum_weights)):
+        picked.add(bisect.bisect(cum_weights, rng.random() * total) + 1)
+    return picked
+
+
+def sized(rng, mean):
+    #1 + geometric, most rows get a few links and a long tail gets many
+    count = 1
+    while rng.random() > 1 / mean:
+        count += 1
+    return count
+
+
+def insert_batches(conn, sql, rows, batch_size, label):
+    c = conn.cursor()
+    start = time.perf_counter()
+    total = 0
     while True:
-        name = random.choice(prefixes) + random.choice(suffixes)
-        if name not in existing_names:
-            existing_names.add(name)
-            return name
-
-# Insert manufacturers
-for i, name in enumerate(manufacturers, start=1):
-    cursor.execute("INSERT INTO Manufacturer VALUES (?, ?)", (i, name))
-
-# Insert diseases
-for i, disease in enumerate(diseases, start=1):
-    cursor.execute("INSERT INTO Disease VALUES (?, ?)", (i, disease))
-
-# Insert NBDrugs
-used_drug_names = set()
-for drug_id in range(1, 200):
-    name = generate_drug_name(used_drug_names)
-    price = random.randint(20, 100)
-    purpose = random.choice(purposes)
-    man_id = random.randint(1, len(manufacturers))
-    cursor.execute("INSERT INTO NBDrugs VALUES (?, ?, ?, ?, ?)", (drug_id, name, price, purpose, man_id))
-
-# Insert Generics
-used_generic_names = set()
-for gen_id in range(1, 206):
-    name = generate_drug_name(used_generic_names)
-    price = random.randint(10, 50)
-    purpose = random.choice(purposes)
-    cursor.execute("INSERT INTO Generics VALUES (?, ?, ?, ?)", (gen_id, name, price, purpose))
-
-# Insert DrugAlt (map drugs 1-199 to generics 1-199)
-for i in range(1, 200):
-    cursor.execute("INSERT INTO DrugAlt VALUES (?, ?)", (i, i))
-
-# Insert Treatment (random valid IDs)
-for i in range(1, 221):
-    disease_id = random.randint(1, len(diseases))
-    drug_id = random.randint(1, 199)
-    cursor.execute("INSERT INTO Treatment VALUES (?, ?)", (disease_id, drug_id))
-
-# Commit and close
-conn.commit()
-conn.close()
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        c.executemany(sql, batch)
+        conn.commit()
+        total += len(batch)
+        print(f"{label}: {total} rows, {total / (time.perf_counter() - start):,.0f} rows/sec")
+    return total
+
+
+def generate(path, manufacturers, drugs, generics, diseases_count, alts_per_drug, diseases_per_drug,
+             zipf_s, seed, batch_size):
+    rng = random.Random(seed)
+
+    #schema (with primary keys) comes from setup.py so fake data matches the real database
+    setup.reset(path)
+    setup.create_tables(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+
+    man_names = numbered(manufacturer_names, manufacturer_suffixes)
+    insert_batches(conn, "INSERT INTO Manufacturer (ManID, Name) VALUES (?, ?)",
+                   ((i, next(man_names)) for i in range(1, manufacturers + 1)), batch_size, "Manufacturer")
+
+    disease_names = numbered(diseases, disease_qualifiers)
+    insert_batches(conn, "INSERT INTO Disease (DiseaseID, Name) VALUES (?, ?)",
+                   ((i, next(disease_names)) for i in range(1, diseases_count + 1)), batch_size, "Disease")
+
+    #a few manufacturers make most of the drugs
+    man_weights = zipf_cum_weights(manufacturers, zipf_s)
+    names = drug_names(rng)
+    insert_batches(conn, "INSERT INTO NBDrugs (DrugID, Name, Price, Purpose, ManID) VALUES (?, ?, ?, ?, ?)",
+                   ((drug_id, next(names), rng.randint(20, 100), rng.choice(purposes),
+                     bisect.bisect(man_weights, rng.random() * man_weights[-1]) + 1)
+                    for drug_id in range(1, drugs + 1)), batch_size, "NBDrugs")
+
+    names = drug_names(rng)
+    insert_batches(conn, "INSERT INTO Generics (GenID, Name, Price, Purpose) VALUES (?, ?, ?, ?)",
+                   ((gen_id, next(names), rng.randint(10, 50), rng.choice(purposes))
+                    for gen_id in range(1, generics + 1)), batch_size, "Generics")
+
+    def alt_rows():
+        for drug_id in range(1, drugs + 1):
+            for gen_id in {rng.randint(1, generics) for _ in range(sized(rng, alts_per_drug))}:
+                yield drug_id, gen_id
+
+    insert_batches(conn, "INSERT INTO DrugAlt (DrugID, GenID) VALUES (?, ?)", alt_rows(), batch_size, "DrugAlt")
+
+    #disease popularity is zipfian, a handful of diseases have most of the drugs
+    disease_weights = zipf_cum_weights(diseases_count, zipf_s)
+
+    def treatment_rows():
+        for drug_id in range(1, drugs + 1):
+            for disease_id in zipf_sample(rng, disease_weights, sized(rng, diseases_per_drug)):
+                yield disease_id, drug_id
+
+    insert_batches(conn, "INSERT INTO Treatment (DiseaseID, DrugID) VALUES (?, ?)", treatment_rows(),
+                   batch_size, "Treatment")
+
+    setup.create_indexes(conn)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic fake drug database")
+    parser.add_argument("--db", default="fake.db")
+    parser.add_argument("--manufacturers", type=int, default=5)
+    parser.add_argument("--drugs", type=int, default=199)
+    parser.add_argument("--generics", type=int, default=205)
+    parser.add_argument("--diseases", type=int, default=6)
+    parser.add_argument("--alts-per-drug", type=float, default=1.5, help="mean generic alternatives per drug")
+    parser.add_argument("--diseases-per-drug", type=float, default=2.0, help="mean diseases treated per drug")
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of disease and manufacturer popularity")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=50000, help="rows per transaction")
+    args = parser.parse_args()
+
+    generate(args.db, args.manufacturers, args.drugs, args.generics, args.diseases, args.alts_per_drug,
+             args.diseases_per_drug, args.zipf, args.seed, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
+import argparse
+import os
 import sqlite3
+import sys
+import time
+from multiprocessing import Pool
+
 import pandas as pd
 import setup
 
+#the server's precomputed tables are rebuilt with the server's own queries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import savings
+
 #TO RUN: 
 #python3 populateDB.py 
 
+#TO REFRESH an existing drug.db with a new medicare release, without dropping anything:
+#python3 populateDB.py --incremental --csv Medicare2023.csv
+#add --prune to also remove drugs that are no longer in the release
+
 #TO LOOK AT drug.db file
 #sqlite3 drug.db
 #.tables lists the tables 
@@ -23,65 +37,245 @@ import setup
     # df = pd.read_csv('drug_namesSIDER.tsv', sep='\t')
 
 
-def populate(): 
-    conn = sqlite3.connect('drug.db')
+MEDICARE_COLUMNS = ['Brnd_Name', 'Gnrc_Name', 'Mftr_Name', 'Avg_Spnd_Per_Bene_2022']
+CHUNK_SIZE = 50000
+#Manufacturer.Name is NOT NULL, rows with a blank Mftr_Name are filed under this one
+UNKNOWN_MANUFACTURER = 'Unknown'
+
+
+def clean_name(value): 
+    if not isinstance(value, str): 
+        return None
+    value = " ".join(value.split())
+    return value or None
+
+
+def normalize_rows(rows): 
+    #(brand, generic, manufacturer, price) tuples with whitespace collapsed,
+    #missing prices as None and missing manufacturers as UNKNOWN_MANUFACTURER,
+    #rows without a brand or generic name are dropped
+    #both the full load and the incremental refresh go through here so their natural keys match
+    cleaned = []
+    for brand_name, gen_name, manu_name, price in rows: 
+        brand_name, gen_name = clean_name(brand_name), clean_name(gen_name)
+        manu_name = clean_name(manu_name) or UNKNOWN_MANUFACTURER
+        if brand_name is None or gen_name is None: 
+            continue
+        price = None if pd.isna(price) else round(float(price), 2)
+        cleaned.append((brand_name, gen_name, manu_name, price))
+    return cleaned
+
+
+def populate(path='drug.db', csv_path='Medicare.csv', chunksize=CHUNK_SIZE): 
+    conn = sqlite3.connect(path)
     c = conn.cursor()
 
-    #Get medicare data 
-    df_data = pd.read_csv('Medicare.csv', usecols = ['Brnd_Name', 'Gnrc_Name', 'Mftr_Name', 'Avg_Spnd_Per_Bene_2022'])
-
-    #to see first few rows of data from file
-    #print(df_data.head())
-
-    #iterate through each row in the FDA product data 
-    for i, row in df_data.iterrows(): 
-        brand_name = row['Brnd_Name']
-        gen_name = row['Gnrc_Name']
-        manu_name = row['Mftr_Name']
-        price = row['Avg_Spnd_Per_Bene_2022']
-
-        #check if manufacturer exists
-        c.execute("SELECT ManID FROM Manufacturer WHERE Name = ?", (manu_name,))
-        manuID = c.fetchone()
-
-        #only add each manufacturer name once into the Manufacturer table
-        if manuID is None: 
-            c.execute("""INSERT OR IGNORE INTO Manufacturer (Name) VALUES (?)""", (manu_name,))
-            manuID = c.lastrowid #autogenerates an ID
-        else: 
-            manuID = manuID[0]
-        
-        #its a generic drug if brand name = generic name in the csv
-        if brand_name == gen_name: 
-            c.execute("INSERT INTO Generics (Name, Price, Purpose) VALUES (?, ?, ?)", 
-                      (gen_name, price, 'purpose'), )
-            genID = c.lastrowid
-        else: 
-            c.execute("INSERT INTO NBDrugs (Name, Price, Purpose, ManID) VALUES (?, ?, ?, ?)", 
-                      (brand_name, price, 'purpose', manuID), )
-            drugID = c.lastrowid
+    #nothing else reads the file during a load, so skip fsyncs and the on-disk journal
+    c.execute("PRAGMA synchronous = OFF")
+    c.execute("PRAGMA journal_mode = MEMORY")
+
+    #name -> id, so each manufacturer / generic is inserted once without a SELECT per row
+    manufacturers = {}
+    generics = {}
+    next_man = (c.execute("SELECT MAX(ManID) FROM Manufacturer").fetchone()[0] or 0) + 1
+    next_gen = (c.execute("SELECT MAX(GenID) FROM Generics").fetchone()[0] or 0) + 1
+    next_drug = (c.execute("SELECT MAX(DrugID) FROM NBDrugs").fetchone()[0] or 0) + 1
+
+    start = time.perf_counter()
+    total = 0
+
+    #read the medicare csv a chunk at a time instead of one giant frame
+    for chunk in pd.read_csv(csv_path, usecols=MEDICARE_COLUMNS, chunksize=chunksize): 
+        man_rows, gen_rows, drug_rows, alt_rows = [], [], [], []
+
+        for brand_name, gen_name, manu_name, price in normalize_rows(chunk[MEDICARE_COLUMNS].itertuples(index=False, name=None)): 
+            #only add each manufacturer name once into the Manufacturer table
+            manuID = manufacturers.get(manu_name)
+            if manuID is None: 
+                manuID = manufacturers[manu_name] = next_man
+                next_man += 1
+                man_rows.append((manuID, manu_name))
 
             #insert to generic (if not added)
-            c.execute("SELECT GenID FROM Generics WHERE Name = ?", (gen_name,))
-            gen = c.fetchone()
-            if gen is None: 
-                c.execute("INSERT INTO Generics (Name, Price, Purpose) VALUES (?, ?, ?)", 
-                          (gen_name, price, 'purpose'))
-                genID = c.lastrowid
-            else:
-                genID = gen[0]
-
-            # Insert into DrugAlt to map NBDrug to Generic
-            c.execute("INSERT INTO DrugAlt (DrugID, GenID) VALUES (?, ?)", (drugID, genID))
-
-    conn.commit()
+            genID = generics.get(gen_name)
+            if genID is None: 
+                genID = generics[gen_name] = next_gen
+                next_gen += 1
+                gen_rows.append((genID, gen_name, price, 'purpose'))
+
+            #its a generic drug if brand name = generic name in the csv
+            if brand_name != gen_name: 
+                drug_rows.append((next_drug, brand_name, price, 'purpose', manuID))
+                # Insert into DrugAlt to map NBDrug to Generic
+                alt_rows.append((next_drug, genID))
+                next_drug += 1
+
+        c.executemany("INSERT INTO Manufacturer (ManID, Name) VALUES (?, ?)", man_rows)
+        c.executemany("INSERT INTO Generics (GenID, Name, Price, Purpose) VALUES (?, ?, ?, ?)", gen_rows)
+        c.executemany("INSERT INTO NBDrugs (DrugID, Name, Price, Purpose, ManID) VALUES (?, ?, ?, ?, ?)", drug_rows)
+        c.executemany("INSERT OR IGNORE INTO DrugAlt (DrugID, GenID) VALUES (?, ?)", alt_rows)
+        conn.commit()
+
+        total += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{total} rows loaded, {total / elapsed:,.0f} rows/sec")
+
+    #indexes are built once at the end rather than maintained during the inserts
+    setup.create_indexes(conn)
+    print(f"done: {total} rows in {time.perf_counter() - start:.2f}s")
+
     conn.close()
 
+def read_release(csv_path, workers, chunksize=CHUNK_SIZE): 
+    #normalizes the csv shards on a process pool and merges them into
+    #manufacturer names, generic name -> price and (brand, generic, manufacturer) -> price
+    #the first row seen for a key wins, like in populate()
+    manufacturers = set()
+    generics = {}
+    drugs = {}
+
+    chunks = (chunk[MEDICARE_COLUMNS].itertuples(index=False, name=None)
+              for chunk in pd.read_csv(csv_path, usecols=MEDICARE_COLUMNS, chunksize=chunksize))
+    with Pool(workers) as pool: 
+        for rows in pool.imap(normalize_rows, (list(rows) for rows in chunks)): 
+            for brand_name, gen_name, manu_name, price in rows: 
+                manufacturers.add(manu_name)
+                generics.setdefault(gen_name, price)
+                if brand_name != gen_name: 
+                    drugs.setdefault((brand_name, gen_name, manu_name), price)
+
+    return manufacturers, generics, drugs
+
+
+def refresh(path='drug.db', csv_path='Medicare.csv', workers=None, prune=False): 
+    #upserts a new release into an existing database
+    #rows are matched on natural keys (names) instead of ids, and every change is
+    #applied in one transaction so readers see either the old or the new release
+    start = time.perf_counter()
+    manufacturers, generics, drugs = read_release(csv_path, workers)
+    print(f"read {len(drugs)} drugs, {len(generics)} generics in {time.perf_counter() - start:.2f}s")
+
+    conn = sqlite3.connect(path, timeout=30)
+    c = conn.cursor()
+    #WAL lets the api keep reading the old data while the refresh is being written
+    c.execute("PRAGMA journal_mode = WAL")
+    c.execute("BEGIN IMMEDIATE")
+
+    summary = {"manufacturers_added": 0, "generics_added": 0, "generic_prices_changed": 0,
+               "drugs_added": 0, "drug_prices_changed": 0, "alternatives_added": 0, "drugs_removed": 0}
+    try: 
+        man_ids = dict(c.execute("SELECT Name, ManID FROM Manufacturer"))
+        next_man = max(man_ids.values(), default=0) + 1
+        new_men = []
+        for manu_name in manufacturers: 
+            if manu_name not in man_ids: 
+                man_ids[manu_name] = next_man
+                new_men.append((next_man, manu_name))
+                next_man += 1
+        c.executemany("INSERT INTO Manufacturer (ManID, Name) VALUES (?, ?)", new_men)
+        summary["manufacturers_added"] = len(new_men)
+
+        existing_generics = {name: (gen_id, price) for gen_id, name, price in c.execute("SELECT GenID, Name, Price FROM Generics")}
+        next_gen = max((gen_id for gen_id, _ in existing_generics.values()), default=0) + 1
+        new_gens, gen_prices = [], []
+        gen_ids = {}
+        for gen_name, price in generics.items(): 
+            if gen_name in existing_generics: 
+                gen_id, old_price = existing_generics[gen_name]
+                if old_price != price: 
+                    gen_prices.append((price, gen_id))
+            else: 
+                gen_id = next_gen
+                next_gen += 1
+                new_gens.append((gen_id, gen_name, price, 'purpose'))
+            gen_ids[gen_name] = gen_id
+        for gen_name, (gen_id, _) in existing_generics.items(): 
+            gen_ids.setdefault(gen_name, gen_id)
+        c.executemany("INSERT INTO Generics (GenID, Name, Price, Purpose) VALUES (?, ?, ?, ?)", new_gens)
+        c.executemany("UPDATE Generics SET Price = ? WHERE GenID = ?", gen_prices)
+        summary["generics_added"] = len(new_gens)
+        summary["generic_prices_changed"] = len(gen_prices)
+
+        existing_drugs = {}
+        for drug_id, brand_name, price, gen_name, manu_name in c.execute("""
+                SELECT nbd.DrugID, nbd.Name, nbd.Price, g.Name, m.Name
+                FROM NBDrugs AS nbd
+                JOIN DrugAlt AS da ON da.DrugID = nbd.DrugID
+                JOIN Generics AS g ON g.GenID = da.GenID
+                LEFT JOIN Manufacturer AS m ON m.ManID = nbd.ManID"""): 
+            existing_drugs.setdefault((brand_name, gen_name, manu_name), (drug_id, price))
+        next_drug = (c.execute("SELECT MAX(DrugID) FROM NBDrugs").fetchone()[0] or 0) + 1
+        new_drugs, new_alts, drug_prices = [], [], []
+        for (brand_name, gen_name, manu_name), price in drugs.items(): 
+            if (brand_name, gen_name, manu_name) in existing_drugs: 
+                drug_id, old_price = existing_drugs[(brand_name, gen_name, manu_name)]
+                if old_price != price: 
+                    drug_prices.append((price, drug_id))
+                continue
+            new_drugs.append((next_drug, brand_name, price, 'purpose', man_ids[manu_name]))
+            new_alts.append((next_drug, gen_ids[gen_name]))
+            next_drug += 1
+        c.executemany("INSERT INTO NBDrugs (DrugID, Name, Price, Purpose, ManID) VALUES (?, ?, ?, ?, ?)", new_drugs)
+        c.executemany("INSERT OR IGNORE INTO DrugAlt (DrugID, GenID) VALUES (?, ?)", new_alts)
+        c.executemany("UPDATE NBDrugs SET Price = ? WHERE DrugID = ?", drug_prices)
+        summary["drugs_added"] = len(new_drugs)
+        summary["alternatives_added"] = len(new_alts)
+        summary["drug_prices_changed"] = len(drug_prices)
+
+        if prune: 
+            removed = [(drug_id,) for key, (drug_id, _) in existing_drugs.items() if key not in drugs]
+            c.executemany("DELETE FROM Treatment WHERE DrugID = ?", removed)
+            c.executemany("DELETE FROM DrugAlt WHERE DrugID = ?", removed)
+            c.executemany("DELETE FROM NBDrugs WHERE DrugID = ?", removed)
+            summary["drugs_removed"] = len(removed)
+
+        #the server's precomputed tables (server/summary.py) have to follow the new prices
+        if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'MultiDiseaseSummary'").fetchone(): 
+            c.executemany("UPDATE MultiDiseaseSummary SET Price = ? WHERE DrugID = ?", drug_prices)
+            if prune: 
+                c.executemany("DELETE FROM MultiDiseaseSummary WHERE DrugID = ?", removed)
+        if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'DrugSavings'").fetchone(): 
+            #prices and links changed all over, re-rank every drug
+            savings.rebuild_drug_savings(c)
+        if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'DiseaseSavings'").fetchone(): 
+            savings.rebuild_disease_savings(c)
+        #moves the server's ETags on (server/migrations.py v5)
+        if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'DataVersion'").fetchone(): 
+            c.execute("UPDATE DataVersion SET Version = Version + 1")
+
+        conn.commit()
+    except BaseException: 
+        conn.rollback()
+        raise
+    finally: 
+        conn.close()
+
+    print(f"refresh done in {time.perf_counter() - start:.2f}s")
+    for change, count in summary.items(): 
+        print(f"  {change}: {count}")
+    return summary
+
+
 def main(): 
+    parser = argparse.ArgumentParser(description="Load Medicare drug data into drug.db")
+    parser.add_argument("--db", default="drug.db")
+    parser.add_argument("--csv", default="Medicare.csv")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert into the existing tables instead of rebuilding them")
+    parser.add_argument("--prune", action="store_true",
+                        help="with --incremental, delete drugs missing from the csv")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to normalize the csv (defaults to the cpu count)")
+    args = parser.parse_args()
+
+    if args.incremental: 
+        refresh(args.db, args.csv, args.workers, args.prune)
+        return
+
     #populate the database with data
-    setup.reset()
-    setup.create_tables()
-    populate()
+    setup.reset(args.db)
+    setup.create_tables(args.db)
+    populate(args.db, args.csv)
 
 if __name__ == "__main__":
     main()
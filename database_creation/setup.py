@@ -1,7 +1,7 @@
 import sqlite3
 
-def reset():
-    conn = sqlite3.connect('drug.db')
+def reset(path='drug.db'):
+    conn = sqlite3.connect(path)
     c = conn.cursor()
 
     c.execute("DROP TABLE IF EXISTS Manufacturer")
@@ -10,13 +10,20 @@ def reset():
     c.execute("DROP TABLE IF EXISTS Generics")
     c.execute("DROP TABLE IF EXISTS DrugAlt")
     c.execute("DROP TABLE IF EXISTS Treatment")
+    c.execute("DROP TABLE IF EXISTS MultiDiseaseSummary")
+    c.execute("DROP TABLE IF EXISTS DrugSavings")
+    c.execute("DROP TABLE IF EXISTS DiseaseSavings")
+    c.execute("DROP TABLE IF EXISTS DataVersion")
+
+    #lets the server's migrations (server/migrations.py) run again on the fresh tables
+    c.execute("PRAGMA user_version = 0")
 
     conn.commit()
     conn.close()
 
 
-def create_tables(): 
-    conn = sqlite3.connect('drug.db')
+def create_tables(path='drug.db'): 
+    conn = sqlite3.connect(path)
     c = conn.cursor(); 
 
     c.execute("""CREATE TABLE IF NOT EXISTS Manufacturer ( 
@@ -65,3 +72,22 @@ def create_tables():
 
     conn.commit()
     conn.close()
+
+
+def create_indexes(conn):
+    #build after a bulk load, filling a table and then indexing it is much faster
+    #than keeping the indexes up to date row by row
+    #(the server adds the same ones through server/migrations.py if they are missing)
+    c = conn.cursor()
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nbdrugs_name ON NBDrugs (Name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nbdrugs_manid ON NBDrugs (ManID)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_generics_name ON Generics (Name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_disease_name ON Disease (Name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_treatment_drugid ON Treatment (DrugID, DiseaseID)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_treatment_diseaseid ON Treatment (DiseaseID, DrugID)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drugalt_drugid ON DrugAlt (DrugID, GenID)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drugalt_genid ON DrugAlt (GenID)")
+    c.execute("ANALYZE")
+
+    conn.commit()
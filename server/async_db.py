@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+class async_database:
+    """
+    Runs the blocking sql.database methods on a bounded thread pool so a slow
+    search never stalls the event loop.
+    Any method of the wrapped client can be awaited directly:
+        await client.Drug_Search_Mode_six(0, "Acu")
+    """
+
+    def __init__(self, client, workers=config.DB_WORKERS, max_concurrency=config.DB_MAX_CONCURRENCY, cache=None):
+        self.client = client
+        self.cache = cache
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drugbase-db")
+        self.limit = asyncio.Semaphore(max_concurrency)
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            await self.limit.acquire()
+        finally:
+            self.queued -= 1
+        wait = time.perf_counter() - start
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.total_run += time.perf_counter() - started
+            self.limit.release()
+        self.completed += 1
+        return result
+
+    async def cached(self, tables, name, *args):
+        """
+        Like awaiting the method directly, but answered from the result cache when
+        none of the tables the query reads have been written since it was stored.
+        """
+        if self.cache is None:
+            return await self.run(getattr(self.client, name), *args)
+        key = (name,) + args
+        hit, value = self.cache.lookup(key)
+        if hit:
+            return value
+        generations = self.cache.snapshot(tables)
+        value = await self.run(getattr(self.client, name), *args)
+        self.cache.store(key, value, generations)
+        return value
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait / finished * 1000, 3) if finished else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "avg_run_ms": round(self.total_run / finished * 1000, 3) if finished else 0.0,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+#TO RUN (from server/):
+#python3 bench.py --sizes 10000 100000 1000000 --out bench_results.json
+#python3 bench.py --sizes 10000 --compare bench_results.json   (exits 1 on a regression)
+
+#Every size gets its own seeded database (cached in --workdir) and its own child process,
+#so config, caches and the page cache of one size never leak into the next
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "database_creation"))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pick(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(pick(50) * 1000, 3),
+        "p90_ms": round(pick(90) * 1000, 3),
+        "p99_ms": round(pick(99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def seed_database(workdir, drugs, seed):
+    import insert_fake
+
+    path = os.path.join(workdir, f"bench_{drugs}_{seed}.db")
+    if not os.path.exists(path):
+        insert_fake.generate(path, manufacturers=max(5, drugs // 1000), drugs=drugs, generics=drugs * 3 // 2,
+                             diseases_count=max(6, drugs // 200), alts_per_drug=1.5, diseases_per_drug=2.0,
+                             zipf_s=1.1, seed=seed, batch_size=50000)
+    return path
+
+
+def sample_queries(db, rng, count):
+    drug_names = [name for _, name in db.dev_get_all_drugs()]
+    disease_names = [name for _, name in db.dev_get_all_diseases()]
+    drugs = [rng.choice(drug_names) for _ in range(count)]
+    return {
+        "drug_names": drugs,
+        "drug_prefixes": [name[:rng.randint(1, 4)] for name in drugs],
+        "disease_prefixes": [rng.choice(disease_names)[:rng.randint(1, 4)] for _ in range(count)],
+    }
+
+
+def time_calls(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_sql(db, queries, iterations, full_table_iterations):
+    drugs, drug_prefixes, disease_prefixes = queries["drug_names"], queries["drug_prefixes"], queries["disease_prefixes"]
+    reads = {
+        "Drug_Search_Mode_six": (db.Drug_Search_Mode_six, [(0, p) for p in drug_prefixes[:iterations]]),
+        "Disease_Search_Mode_six": (db.Disease_Search_Mode_six, [(0, p) for p in disease_prefixes[:iterations]]),
+        "Multi_Disease_Treatment_Search": (db.Multi_Disease_Treatment_Search,
+                                           [(0, 2 + i % 3) for i in range(iterations)]),
+        "Get_Description_Drug": (db.Get_Description_Drug, [(name,) for name in drugs[:iterations]]),
+        "Cheapest_Alternatives": (db.Cheapest_Alternatives, [(name, 3) for name in drugs[:iterations]]),
+        "dev_get_all_manufacturers": (db.dev_get_all_manufacturers, [()] * full_table_iterations),
+        "dev_get_all_diseases": (db.dev_get_all_diseases, [()] * full_table_iterations),
+        "dev_get_all_drugs": (db.dev_get_all_drugs, [()] * full_table_iterations),
+        "dev_get_all_generics": (db.dev_get_all_generics, [()] * full_table_iterations),
+    }
+    results = {name: time_calls(fn, args) for name, (fn, args) in reads.items()}
+
+    #writes run last, on the scratch copy of the database
+    drug_ids = [row[0] for row in db.dev_get_all_drugs()[-iterations:]]
+    writes = {
+        "dev_insert_manufacturer": (db.dev_insert_manufacturer, [(f"Bench Labs {i}",) for i in range(iterations)]),
+        "dev_insert_drug": (db.dev_insert_drug, [(f"Benchdrug {i}", 50, "Bench", 1) for i in range(iterations)]),
+        "dev_insert_generic": (db.dev_insert_generic, [(f"Benchgen {i}", 20, "Bench") for i in range(iterations)]),
+        "dev_insert_treatment": (db.dev_insert_treatment, [(1, drug_id, 1) for drug_id in drug_ids]),
+        "dev_update_manufacturer_name": (db.dev_update_manufacturer_name,
+                                         [(1 + i % 5, f"Renamed {i}") for i in range(iterations)]),
+        "dev_delete_drug_cascade": (db.dev_delete_drug_cascade, [(drug_id,) for drug_id in drug_ids]),
+    }
+    results.update({name: time_calls(fn, args) for name, (fn, args) in writes.items()})
+    return results
+
+
+async def drive_http(app, urls, concurrency):
+    import httpx
+
+    samples = []
+    errors = 0
+    pending = iter(urls)
+
+    async def worker(http):
+        nonlocal errors
+        for url in pending:
+            start = time.perf_counter()
+            response = await http.get(url)
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    stats = percentiles(samples)
+    stats["requests_per_sec"] = round(len(samples) / elapsed, 1)
+    stats["errors"] = errors
+    return stats
+
+
+def bench_http(queries, concurrency_levels, requests):
+    import server
+
+    urls = []
+    for i in range(requests):
+        kind = i % 4
+        if kind == 0:
+            urls.append(f"/Drug_Search/0/{queries['drug_prefixes'][i % len(queries['drug_prefixes'])]}")
+        elif kind == 1:
+            urls.append(f"/Disease_Search/0/{queries['disease_prefixes'][i % len(queries['disease_prefixes'])]}")
+        elif kind == 2:
+            urls.append(f"/Multi_Disease_Treatment/0/{2 + i % 3}")
+        else:
+            urls.append(f"/desc/{queries['drug_names'][i % len(queries['drug_names'])]}")
+
+    async def drive_levels():
+        # httpx's ASGI transport does not send lifespan events, start the app the way uvicorn would
+        async with server.lifespan(server.app):
+            return {str(level): await drive_http(server.app, urls, level) for level in concurrency_levels}
+
+    return asyncio.run(drive_levels())
+
+
+def run_child(args):
+    #runs inside the per-size child process, DRUGBASE_DB_PATH already points at the scratch copy
+    import sql
+
+    rng = random.Random(args.seed)
+    db = sql.database()
+    queries = sample_queries(db, rng, max(args.iterations, args.requests))
+    result = {"drugs": args.child_size}
+    if not args.skip_http:
+        # before the write benchmarks, so every size serves the same data
+        result["http"] = bench_http(queries, args.concurrency, args.requests)
+    result["sql"] = bench_sql(db, queries, args.iterations, args.full_table_iterations)
+    print(json.dumps(result))
+
+
+def compare(results, baseline_path, threshold, min_delta_ms):
+    with open(baseline_path) as f:
+        baseline = {run["drugs"]: run for run in json.load(f)["results"]}
+    regressions = []
+    for run in results:
+        old = baseline.get(run["drugs"])
+        if old is None:
+            continue
+        for method, stats in run["sql"].items():
+            before = old["sql"].get(method)
+            if (before and stats["p90_ms"] > before["p90_ms"] * threshold
+                    and stats["p90_ms"] - before["p90_ms"] > min_delta_ms):
+                regressions.append(f"{run['drugs']} drugs {method}: p90 {before['p90_ms']}ms -> {stats['p90_ms']}ms")
+        for level, stats in run.get("http", {}).items():
+            before = old.get("http", {}).get(level)
+            if before and stats["requests_per_sec"] * threshold < before["requests_per_sec"]:
+                regressions.append(f"{run['drugs']} drugs http x{level}: "
+                                   f"{before['requests_per_sec']} -> {stats['requests_per_sec']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sql.database query layer and the FastAPI app")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="NBDrugs rows")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per sql.database method")
+    parser.add_argument("--full-table-iterations", type=int, default=5, help="calls per dev_get_all_* method")
+    parser.add_argument("--requests", type=int, default=1000, help="http requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=os.path.join(HERE, "bench_data"))
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file, exit 1 if anything got slower")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="ignore p90 slowdowns smaller than this, sub-millisecond timings are noisy")
+    parser.add_argument("--child-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_size is not None:
+        run_child(args)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        print(f"seeding {size} drugs", file=sys.stderr)
+        path = seed_database(args.workdir, size, args.seed)
+        scratch = os.path.join(args.workdir, "scratch.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+        shutil.copyfile(path, scratch)
+
+        print(f"benchmarking {size} drugs", file=sys.stderr)
+        child = [sys.executable, os.path.abspath(__file__), "--child-size", str(size),
+                 "--iterations", str(args.iterations), "--full-table-iterations", str(args.full_table_iterations),
+                 "--requests", str(args.requests), "--seed", str(args.seed),
+                 "--concurrency", *map(str, args.concurrency)] + (["--skip-http"] if args.skip_http else [])
+        # one client driving the whole load would only measure the rate limiter
+        env = dict(os.environ, DRUGBASE_DB_PATH=scratch, DRUGBASE_RATE_LIMIT_CHEAP="0",
+                   DRUGBASE_RATE_LIMIT_EXPENSIVE="0")
+        output = subprocess.run(child, env=env, cwd=HERE, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "seed": args.seed, "iterations": args.iterations, "requests": args.requests,
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}", file=sys.stderr)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold, args.min_delta_ms)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
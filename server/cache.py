@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class result_cache:
+    """
+    LRU + TTL cache for query results.
+    Every entry remembers the generation of the tables it was read from,
+    a write to any of those tables bumps its generation and the entry is dropped on its next lookup.
+    """
+
+    def __init__(self, max_entries=config.RESULT_CACHE_MAX_ENTRIES, max_rows=config.RESULT_CACHE_MAX_ROWS,
+                 ttl=config.RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.generation = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def snapshot(self, tables):
+        """
+        Generations to pass to store(), taken before the query runs so a write
+        that lands while it runs still invalidates the result.
+        """
+        # "*" is bumped by writes from other processes, which may have touched any table
+        return tuple((table, self.generation.get(table, 0)) for table in tuple(tables) + ("*",))
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, expires, generations = entry
+            if any(self.generation.get(table, 0) != gen for table, gen in generations):
+                self._drop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return False, None
+            if expires < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def store(self, key, value, generations):
+        size = len(value) if hasattr(value, "__len__") else 1
+        if size > self.max_rows:
+            return
+        with self.lock:
+            if any(self.generation.get(table, 0) != gen for table, gen in generations):
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, time.monotonic() + self.ttl, generations)
+            self.rows += size
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        value = self.entries.pop(key)[0]
+        self.rows -= len(value) if hasattr(value, "__len__") else 1
+
+    def on_write(self, table, action, row):
+        with self.lock:
+            self.generation[table] = self.generation.get(table, 0) + 1
+        if table == "*":
+            # written by another process, no telling which tables changed
+            self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.rows = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "rows": self.rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,94 @@
+import os
+
+# Settings are read from the environment so each uvicorn worker can be tuned
+# without code changes, e.g. DRUGBASE_DB_WORKERS=16 uvicorn server:app
+
+# the default is next to this file rather than the working directory,
+# a relative DRUGBASE_DB_PATH is still taken from where the server was started
+DB_PATH = os.environ.get("DRUGBASE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake.db"))
+
+# seconds sqlite waits on a locked database before raising
+BUSY_TIMEOUT = float(os.environ.get("DRUGBASE_BUSY_TIMEOUT", "5"))
+
+# threads that run sqlite calls off the event loop
+DB_WORKERS = int(os.environ.get("DRUGBASE_DB_WORKERS", str(os.cpu_count() or 4)))
+
+# how many database calls may run at once, the rest wait in a queue
+DB_MAX_CONCURRENCY = int(os.environ.get("DRUGBASE_DB_MAX_CONCURRENCY", str(DB_WORKERS)))
+
+# read-only connections kept by the pool, writes always go through one connection
+READ_POOL_SIZE = int(os.environ.get("DRUGBASE_READ_POOL_SIZE", str(DB_WORKERS)))
+
+# seconds to wait for a free read connection before giving up
+POOL_TIMEOUT = float(os.environ.get("DRUGBASE_POOL_TIMEOUT", "10"))
+
+# idle connections older than this are pinged before being handed out
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("DRUGBASE_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+# per connection page cache (KiB) and memory map size (bytes)
+CACHE_SIZE_KB = int(os.environ.get("DRUGBASE_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.environ.get("DRUGBASE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# default and maximum matches per kind returned by /autocomplete
+AUTOCOMPLETE_LIMIT = int(os.environ.get("DRUGBASE_AUTOCOMPLETE_LIMIT", "10"))
+AUTOCOMPLETE_MAX_LIMIT = int(os.environ.get("DRUGBASE_AUTOCOMPLETE_MAX_LIMIT", "100"))
+
+# search result cache, bounded by entry count and by total rows held
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("DRUGBASE_RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_MAX_ROWS = int(os.environ.get("DRUGBASE_RESULT_CACHE_MAX_ROWS", "200000"))
+RESULT_CACHE_TTL = float(os.environ.get("DRUGBASE_RESULT_CACHE_TTL", "300"))
+
+# per statement timing for /metrics, set to 0 to turn it off entirely
+INSTRUMENT = os.environ.get("DRUGBASE_INSTRUMENT", "1") == "1"
+
+# statements slower than this are logged with their EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = float(os.environ.get("DRUGBASE_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("DRUGBASE_SLOW_QUERY_LOG_SIZE", "100"))
+
+# most names/ids accepted by one batch lookup
+BATCH_MAX_ITEMS = int(os.environ.get("DRUGBASE_BATCH_MAX_ITEMS", "500"))
+
+# most records (and body bytes) accepted by one /dev/bulk/* request, they are written in a single transaction
+BULK_MAX_ITEMS = int(os.environ.get("DRUGBASE_BULK_MAX_ITEMS", "100000"))
+BULK_MAX_BYTES = int(os.environ.get("DRUGBASE_BULK_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# rows fetched per fetchmany() by the streaming exports
+EXPORT_BATCH_SIZE = int(os.environ.get("DRUGBASE_EXPORT_BATCH_SIZE", "1000"))
+# exports and /dev dumps running at once, each on its own connection outside the read pool
+EXPORT_MAX_STREAMS = int(os.environ.get("DRUGBASE_EXPORT_MAX_STREAMS", "2"))
+
+# fuzzy search: minimum trigram similarity (0-1)
+FUZZY_MIN_SIMILARITY = float(os.environ.get("DRUGBASE_FUZZY_MIN_SIMILARITY", "0.3"))
+
+# answer the drug, disease and multi-disease searches from an in-memory copy of the catalog
+# (snapshot.py), reloaded in the background this many seconds after a write
+SNAPSHOT = os.environ.get("DRUGBASE_SNAPSHOT", "0") == "1"
+SNAPSHOT_RELOAD_DELAY = float(os.environ.get("DRUGBASE_SNAPSHOT_RELOAD_DELAY", "0.2"))
+
+# read routes send ETags built from the data version, clients and CDNs may reuse a response
+# for HTTP_CACHE_MAX_AGE seconds before revalidating (0: always revalidate, a 304 is cheap)
+HTTP_CACHE_MAX_AGE = int(os.environ.get("DRUGBASE_HTTP_CACHE_MAX_AGE", "0"))
+# how often the persisted data version is re-read to notice writes from other processes
+DATA_VERSION_CHECK_INTERVAL = float(os.environ.get("DRUGBASE_DATA_VERSION_CHECK_INTERVAL", "1"))
+
+# at startup, prepare the hot statements on every read connection and pre-read the indexes
+# the searches seek, so a new worker's first requests do not pay for cold pages
+WARMUP = os.environ.get("DRUGBASE_WARMUP", "1") == "1"
+
+# most diseases one /Disease_Intersection request may ask for
+INTERSECTION_MAX_DISEASES = int(os.environ.get("DRUGBASE_INTERSECTION_MAX_DISEASES", "20"))
+
+# admission control for the API (limits.py): per-client token buckets, a tighter one for the
+# expensive routes (multi-disease, fuzzy, intersections, exports and /dev dumps), in requests
+# a second and burst size, 0 turns the limit off
+RATE_LIMIT_CHEAP = float(os.environ.get("DRUGBASE_RATE_LIMIT_CHEAP", "50"))
+RATE_LIMIT_CHEAP_BURST = int(os.environ.get("DRUGBASE_RATE_LIMIT_CHEAP_BURST", "100"))
+RATE_LIMIT_EXPENSIVE = float(os.environ.get("DRUGBASE_RATE_LIMIT_EXPENSIVE", "5"))
+RATE_LIMIT_EXPENSIVE_BURST = int(os.environ.get("DRUGBASE_RATE_LIMIT_EXPENSIVE_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("DRUGBASE_RATE_LIMIT_MAX_CLIENTS", "10000"))
+# answer 503 with Retry-After instead of queueing once this many database calls are waiting
+# for a worker, 0 never sheds
+SHED_QUEUE_DEPTH = int(os.environ.get("DRUGBASE_SHED_QUEUE_DEPTH", "64"))
+SHED_RETRY_AFTER = int(os.environ.get("DRUGBASE_SHED_RETRY_AFTER", "1"))
+# identical concurrent GETs on the search routes share one execution
+SINGLE_FLIGHT = os.environ.get("DRUGBASE_SINGLE_FLIGHT", "1") == "1"
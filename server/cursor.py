@@ -0,0 +1,47 @@
+import base64
+import json
+import math
+
+# Opaque pagination cursors: the sort key of the last row on a page,
+# JSON encoded and base64url'd so clients pass it back untouched.
+
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+# what a sort key part may be, anything else would reach sqlite or a comparison as garbage
+SCALARS = (int, float, str, type(None))
+NUMBER = (int, float)
+# sqlite INTEGER range, a bigger int raises OverflowError when bound
+INT_MIN, INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _valid(part, accepted):
+    # json true/false are ints to isinstance, they only pass where bool is asked for
+    if isinstance(part, bool):
+        return accepted is bool or (isinstance(accepted, tuple) and bool in accepted)
+    if isinstance(part, int):
+        return isinstance(part, accepted) and INT_MIN <= part <= INT_MAX
+    if isinstance(part, float):
+        return isinstance(part, accepted) and math.isfinite(part)
+    return isinstance(part, accepted)
+
+
+def decode_cursor(token, size, types=None):
+    """
+    Returns the key tuple stored in token, raises ValueError if it is not a cursor of size parts.
+    types optionally gives the accepted types of each part, otherwise any scalar is.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("malformed cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("cursor does not belong to this endpoint")
+    for part, accepted in zip(key, types or [SCALARS] * size):
+        if not _valid(part, accepted):
+            raise ValueError("malformed cursor")
+    return tuple(key)
@@ -0,0 +1,149 @@
+import bisect
+import heapq
+import math
+import threading
+from array import array
+from collections import Counter
+
+import config
+from names import SOURCES
+from reloader import reloader
+
+
+def trigrams(text):
+    # padded like pg_trgm so the start of a name weighs more than its middle
+    padded = "  " + " ".join(text.casefold().split()) + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class trigram_index:
+    """
+    In-memory trigram inverted index for typo-tolerant, mid-word name search.
+    Postings are sorted id arrays per (trigram, trigram count of the name), so a search only
+    reads names of a length that can reach min_similarity, and a name is never re-split.
+    """
+
+    def __init__(self, min_similarity=config.FUZZY_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.names = {kind: {} for kind in SOURCES}
+        self.sizes = {kind: {} for kind in SOURCES}
+        self.postings = {kind: {} for kind in SOURCES}
+        self.lock = threading.Lock()
+        self.db = None
+        self.reloads = reloader(self.load, "drugbase-fuzzy")
+
+    def load(self, db):
+        self.db = db
+        names = {}
+        sizes = {}
+        postings = {}
+        for kind, method in SOURCES.items():
+            names[kind] = {row_id: name for row_id, name in getattr(db, method)() if name is not None}
+            sizes[kind] = {}
+            postings[kind] = {}
+            for row_id, name in sorted(names[kind].items()):
+                grams = trigrams(name)
+                sizes[kind][row_id] = len(grams)
+                for gram in grams:
+                    postings[kind].setdefault((gram, len(grams)), array("i")).append(row_id)
+        with self.lock:
+            self.names = names
+            self.sizes = sizes
+            self.postings = postings
+
+    def add(self, kind, row_id, name):
+        with self.lock:
+            self._remove(kind, row_id)
+            grams = trigrams(name)
+            self.names[kind][row_id] = name
+            self.sizes[kind][row_id] = len(grams)
+            for gram in grams:
+                bisect.insort(self.postings[kind].setdefault((gram, len(grams)), array("i")), row_id)
+
+    def remove(self, kind, row_id):
+        with self.lock:
+            self._remove(kind, row_id)
+
+    def _remove(self, kind, row_id):
+        # ids are reused after a delete, stale postings would count towards the next name
+        name = self.names[kind].pop(row_id, None)
+        if name is None:
+            return
+        size = self.sizes[kind].pop(row_id)
+        for gram in trigrams(name):
+            self.postings[kind][(gram, size)].remove(row_id)
+
+    def search(self, query, kind, limit, after=None):
+        """
+        Top limit (score, id, name) matches for query, best first, ties by id.
+        after is the (score, id) of the previous page's last match.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        m = self.min_similarity
+        # shared / (len(grams) + size - shared) >= m only for names of min_size to max_size grams
+        # (with 1e-6 of slack, scores are rounded)
+        min_size = max(1, math.ceil(m * len(grams) - 1e-6))
+        max_size = math.floor(len(grams) / m + 1e-6) if m > 0 else len(grams) + 64
+        top = []
+        with self.lock:
+            names = self.names[kind]
+            postings = self.postings[kind]
+            # names nearest the query's length first, they hold the best scores and fill the page
+            for size in sorted(range(min_size, max_size + 1), key=lambda size: abs(size - len(grams))):
+                lists = {gram: postings.get((gram, size), ()) for gram in grams}
+                # a name of this size needs this many shared grams, so it has one of the
+                # len(grams) - needed + 1 rarest: candidates come from their postings only
+                needed = max(1, math.ceil(m * (len(grams) + size) / (1 + m) - 1e-6))
+                if needed > min(len(grams), size):
+                    continue
+                ranked = sorted(grams, key=lambda gram: len(lists[gram]))
+                rare, common = ranked[:len(grams) - needed + 1], ranked[len(grams) - needed + 1:]
+                shared_counts = Counter()
+                for gram in rare:
+                    shared_counts.update(lists[gram])
+                if not shared_counts:
+                    continue
+                # a common posting not much longer than the candidates is cheaper to run through
+                # a membership test on them, in C, than to bisect once per candidate
+                walked = [gram for gram in common if len(lists[gram]) <= 8 * len(shared_counts)]
+                for gram in walked:
+                    shared_counts.update(filter(shared_counts.__contains__, lists[gram]))
+                common = [gram for gram in common if gram not in walked]
+
+                # most hits first: at most hits + len(common) shared, once that bound is
+                # below needed or the limit-th score the rest of this size is never verified
+                for row_id, shared in shared_counts.most_common():
+                    best = min(shared + len(common), size)
+                    if best < needed or (len(top) == limit and top[0][0] > best / (len(grams) + size - best)):
+                        break
+                    # the common grams are checked by membership, exact counts for candidates only
+                    for gram in common:
+                        ids = lists[gram]
+                        i = bisect.bisect_left(ids, row_id)
+                        if i < len(ids) and ids[i] == row_id:
+                            shared += 1
+                    score = round(shared / (len(grams) + size - shared), 6)
+                    if score < m:
+                        continue
+                    if after is not None and (score > after[0] or (score == after[0] and row_id <= after[1])):
+                        continue
+                    # min-heap on (score, -id), top[0] is the worst match kept
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, -row_id))
+                    elif (score, -row_id) > top[0]:
+                        heapq.heapreplace(top, (score, -row_id))
+            return [(score, -neg_id, names[-neg_id]) for score, neg_id in sorted(top, reverse=True)]
+
+    def on_write(self, table, action, row):
+        if table == "*":
+            self.reloads.request(self.db)
+            return
+        self.reloads.written()
+        if table == "NBDrugs" and action == "insert":
+            self.add("drug", row["DrugID"], row["Name"])
+        elif table == "NBDrugs" and action == "delete":
+            self.remove("drug", row["DrugID"])
+        elif table == "Generics" and action == "insert":
+            self.add("generic", row["GenID"], row["Name"])
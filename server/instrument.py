@@ -0,0 +1,158 @@
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import config
+
+log = logging.getLogger("drugbase.slow_queries")
+
+# seconds, roughly the Prometheus client defaults
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class histogram:
+    """
+    Cumulative-bucket latency histogram per label set, rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s histogram" % self.name]
+        with self.lock:
+            items = [(values, list(counts), total) for values, (counts, total) in self.series.items()]
+        for values, counts, total in sorted(items):
+            labels = ",".join('%s="%s"' % (k, escape_label(v)) for k, v in zip(self.labels, values))
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, labels, bound, running))
+            running += counts[-1]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, labels, running))
+            lines.append("%s_sum{%s} %.6f" % (self.name, labels, total))
+            lines.append("%s_count{%s} %d" % (self.name, labels, running))
+        return lines
+
+
+class counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s counter" % self.name]
+        with self.lock:
+            items = sorted(self.values.items())
+        for values, total in items:
+            labels = ",".join('%s="%s"' % (k, escape_label(v)) for k, v in zip(self.labels, values))
+            lines.append("%s{%s} %d" % (self.name, labels, total))
+        return lines
+
+
+class query_instrument:
+    """
+    Records every statement sql.database runs: timing and rows per query name,
+    plus a slow query log with the plan of anything over config.SLOW_QUERY_MS.
+    Extra hooks are called as hook(name, query, params, seconds, rows).
+    """
+
+    def __init__(self, slow_ms=config.SLOW_QUERY_MS, slow_log_size=config.SLOW_QUERY_LOG_SIZE):
+        self.slow_seconds = slow_ms / 1000
+        self.slow_log = deque(maxlen=slow_log_size)
+        self.hooks = []
+        self.latency = histogram("drugbase_query_duration_seconds", "Time spent executing a statement",
+                                 ("query",))
+        self.rows = counter("drugbase_query_rows_total", "Rows returned or changed by statements", ("query",))
+        self.errors = counter("drugbase_query_errors_total", "Statements that raised", ("query",))
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, name, query, params, seconds, rows, conn):
+        self.latency.observe((name,), seconds)
+        self.rows.inc((name,), max(rows, 0))
+        for hook in self.hooks:
+            hook(name, query, params, seconds, rows)
+        if seconds >= self.slow_seconds:
+            self._log_slow(name, query, params, seconds, rows, conn)
+
+    def _log_slow(self, name, query, params, seconds, rows, conn):
+        try:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        except sqlite3.Error as e:
+            plan = ["plan unavailable: %s" % e]
+        entry = {
+            "query": name,
+            "ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "params": [repr(p) for p in params],
+            "plan": plan,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.slow_log.append(entry)
+        log.warning("slow query %s took %.1fms (%d rows), plan: %s", name, entry["ms"], rows, " | ".join(plan))
+
+    def cursor_class(self):
+        """
+        Cursor type for write blocks, times every execute() under the cursor's query_name.
+        """
+        instrument = self
+
+        class timed_cursor(sqlite3.Cursor):
+            query_name = "unnamed"
+
+            def execute(self, query, params=()):
+                start = time.perf_counter()
+                try:
+                    result = super().execute(query, params)
+                except sqlite3.Error:
+                    instrument.errors.inc((self.query_name,))
+                    raise
+                instrument.record(self.query_name, query, params, time.perf_counter() - start,
+                                  self.rowcount, self.connection)
+                return result
+
+            def executemany(self, query, seq_of_params):
+                start = time.perf_counter()
+                try:
+                    result = super().executemany(query, seq_of_params)
+                except sqlite3.Error:
+                    instrument.errors.inc((self.query_name,))
+                    raise
+                # no single parameter set to explain, so executemany never hits the slow log plan
+                instrument.latency.observe((self.query_name,), time.perf_counter() - start)
+                instrument.rows.inc((self.query_name,), max(self.rowcount, 0))
+                return result
+
+        return timed_cursor
+
+    def render(self):
+        return self.latency.render() + self.rows.render() + self.errors.render()
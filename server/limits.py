@@ -0,0 +1,94 @@
+import asyncio
+import math
+import time
+
+import config
+
+
+class token_buckets:
+    """
+    One token bucket per client: refills rate tokens a second up to burst, every request
+    takes one. Buckets idle long enough to be full again are dropped.
+    """
+
+    def __init__(self, rate, burst, max_clients=config.RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, client):
+        """
+        0 when the request may go ahead, otherwise the seconds until a token is available
+        """
+        now = time.monotonic()
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            self.limited += 1
+            return (1 - tokens) / self.rate
+        if len(self.buckets) >= self.max_clients and client not in self.buckets:
+            self._prune(now)
+        self.buckets[client] = (tokens - 1, now)
+        self.allowed += 1
+        return 0
+
+    def _prune(self, now):
+        full_after = self.burst / self.rate
+        self.buckets = {client: (tokens, last) for client, (tokens, last) in self.buckets.items()
+                        if now - last < full_after}
+
+    def stats(self):
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self.buckets),
+                "allowed": self.allowed, "limited": self.limited}
+
+
+def retry_after(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+class single_flight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs it, callers that
+    arrive while it runs await the same future instead of running it again.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.followers += 1
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+            # the leader's client went away, ours is still waiting: run it (or join whoever does)
+            return await self.do(key, fn)
+        flight = self.flights[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # retrieved here so a flight nobody joined does not log "exception never retrieved"
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self.flights[key]
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "leaders": self.leaders, "followers": self.followers}
@@ -0,0 +1,200 @@
+"""
+Schema migrations applied when sql.database starts.
+The version reached so far is kept in PRAGMA user_version, so each step runs once per file.
+"""
+
+import time
+
+from savings import create_disease_savings, create_drug_savings, rebuild_disease_savings, rebuild_drug_savings
+from summary import create_multi_disease_summary, rebuild_multi_disease_summary
+
+
+# fake.db is created without primary keys, so the id columns need their own indexes
+ID_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_manufacturer_manid ON Manufacturer (ManID);
+    CREATE INDEX IF NOT EXISTS idx_nbdrugs_drugid ON NBDrugs (DrugID);
+    CREATE INDEX IF NOT EXISTS idx_generics_genid ON Generics (GenID);
+    CREATE INDEX IF NOT EXISTS idx_disease_diseaseid ON Disease (DiseaseID);
+"""
+
+SEARCH_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_nbdrugs_name ON NBDrugs (Name);
+    CREATE INDEX IF NOT EXISTS idx_nbdrugs_manid ON NBDrugs (ManID);
+
+    CREATE INDEX IF NOT EXISTS idx_generics_name ON Generics (Name);
+
+    CREATE INDEX IF NOT EXISTS idx_disease_name ON Disease (Name);
+
+    CREATE INDEX IF NOT EXISTS idx_treatment_drugid ON Treatment (DrugID, DiseaseID);
+    CREATE INDEX IF NOT EXISTS idx_treatment_diseaseid ON Treatment (DiseaseID, DrugID);
+
+    CREATE INDEX IF NOT EXISTS idx_drugalt_drugid ON DrugAlt (DrugID, GenID);
+    CREATE INDEX IF NOT EXISTS idx_drugalt_genid ON DrugAlt (GenID);
+"""
+
+# the same tables database_creation/setup.py creates, id columns are rowid aliases
+KEYED_TABLES = {
+    "Manufacturer": ("ManID", """(
+            ManID INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL
+            )"""),
+    "NBDrugs": ("DrugID", """(
+            DrugID INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL,
+            Price INTEGER,
+            Purpose TEXT,
+            ManID INTEGER,
+            FOREIGN KEY (ManID) REFERENCES Manufacturer (ManID)
+            )"""),
+    "Disease": ("DiseaseID", """(
+            DiseaseID INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL
+            )"""),
+    "Generics": ("GenID", """(
+            GenID INTEGER PRIMARY KEY,
+            Name TEXT NOT NULL,
+            Price INTEGER,
+            Purpose TEXT
+            )"""),
+}
+
+
+def _execute_each(cur, script):
+    # executescript() would COMMIT the transaction pool.write() opened first, a step and its
+    # user_version bump must land together, so statements run one by one inside it
+    for statement in script.split(";"):
+        if statement.strip():
+            cur.execute(statement)
+
+
+def _v1_search_indexes(cur):
+    _execute_each(cur, ID_INDEXES + SEARCH_INDEXES + "ANALYZE;")
+
+
+def _v2_multi_disease_summary(cur):
+    create_multi_disease_summary(cur)
+    rebuild_multi_disease_summary(cur)
+
+
+def _v3_integer_primary_keys(cur):
+    # rebuilds tables whose id is not an INTEGER PRIMARY KEY, so new rows get their id
+    # from sqlite instead of a SELECT MAX() and the separate id indexes go away
+    rebuilt = False
+    for table, (id_col, schema) in KEYED_TABLES.items():
+        columns = cur.execute("PRAGMA table_info(%s)" % table).fetchall()
+        if any(name == id_col and pk == 1 and col_type.upper() == "INTEGER"
+               for _, name, col_type, _, _, pk in columns):
+            continue
+        names = ", ".join(name for _, name, _, _, _, _ in columns)
+        cur.execute("CREATE TABLE %s_rebuild %s" % (table, schema))
+        cur.execute("INSERT INTO %s_rebuild (%s) SELECT %s FROM %s" % (table, names, names, table))
+        cur.execute("DROP TABLE %s" % table)
+        cur.execute("ALTER TABLE %s_rebuild RENAME TO %s" % (table, table))
+        rebuilt = True
+    if rebuilt:
+        _execute_each(cur, SEARCH_INDEXES + "ANALYZE;")
+    _execute_each(cur, """
+    DROP INDEX IF EXISTS idx_manufacturer_manid;
+    DROP INDEX IF EXISTS idx_nbdrugs_drugid;
+    DROP INDEX IF EXISTS idx_generics_genid;
+    DROP INDEX IF EXISTS idx_disease_diseaseid;
+    """)
+
+
+def _v4_drug_savings(cur):
+    create_drug_savings(cur)
+    rebuild_drug_savings(cur)
+
+
+def _v5_data_version(cur):
+    # seeded from the clock so a rebuilt database never reuses the ETags of an old one
+    cur.execute("CREATE TABLE IF NOT EXISTS DataVersion (Version INTEGER NOT NULL)")
+    cur.execute("INSERT INTO DataVersion (Version) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM DataVersion)",
+                (int(time.time()),))
+
+
+def _v6_drop_nocase_indexes(cur):
+    # every search compares with BINARY collation, these were never used, only maintained
+    _execute_each(cur, """
+    DROP INDEX IF EXISTS idx_nbdrugs_name_nocase;
+    DROP INDEX IF EXISTS idx_generics_name_nocase;
+    DROP INDEX IF EXISTS idx_disease_name_nocase;
+    """)
+
+
+def _v7_disease_savings(cur):
+    # filled from the DrugSavings v4 built, which stays as it is
+    create_disease_savings(cur)
+    rebuild_disease_savings(cur)
+
+
+MIGRATIONS = [
+    _v1_search_indexes,
+    _v2_multi_disease_summary,
+    _v3_integer_primary_keys,
+    _v4_drug_savings,
+    _v5_data_version,
+    _v6_drop_nocase_indexes,
+    _v7_disease_savings,
+]
+
+
+# columns the server reads from the tables database_creation/ builds
+REQUIRED_COLUMNS = {
+    "Manufacturer": ("ManID", "Name"),
+    "NBDrugs": ("DrugID", "Name", "Price", "Purpose", "ManID"),
+    "Generics": ("GenID", "Name", "Price", "Purpose"),
+    "Disease": ("DiseaseID", "Name"),
+    "DrugAlt": ("DrugID", "GenID"),
+    "Treatment": ("DiseaseID", "DrugID"),
+}
+
+
+def validate_schema(conn):
+    """
+    Raises RuntimeError naming every missing table or column, before any migration touches the file.
+    """
+    problems = []
+    for table, required in REQUIRED_COLUMNS.items():
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(%s)" % table)}
+        if not columns:
+            problems.append("missing table %s" % table)
+            continue
+        missing = [column for column in required if column not in columns]
+        if missing:
+            problems.append("%s is missing %s" % (table, ", ".join(missing)))
+    if problems:
+        raise RuntimeError("not a drugbase database: " + "; ".join(problems))
+
+
+def migrate(conn):
+    """
+    Brings the schema up to date, returns the version the file is now at.
+    Steps are idempotent, so a run interrupted before user_version is bumped is safe to repeat.
+    """
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    for step, apply in enumerate(MIGRATIONS[version:], start=version + 1):
+        apply(cur)
+        cur.execute("PRAGMA user_version = %d" % step)
+    cur.close()
+    return len(MIGRATIONS)
+
+
+def prefix_range(prefix):
+    """
+    Turns a prefix into [low, high) bounds so `Name >= low AND Name < high`
+    matches the same rows as `substr(Name, 1, len(prefix)) = prefix`
+    while still being answerable from an index on Name.
+    """
+    if not prefix:
+        return "", "\U0010ffff"
+    # the last character that can still be incremented, U+10FFFF has no successor
+    stem = prefix.rstrip("\U0010ffff")
+    if not stem:
+        return prefix, prefix + "\U0010ffff"
+    code = ord(stem[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # surrogates cannot be encoded for sqlite, the next character after them sorts the same
+        code = 0xE000
+    return prefix, stem[:-1] + chr(code)
@@ -0,0 +1,75 @@
+import bisect
+import threading
+
+from reloader import reloader
+
+# sql.database methods returning (id, name) rows for each kind
+SOURCES = {
+    "drug": "dev_get_all_drugs",
+    "generic": "dev_get_all_generics",
+    "disease": "dev_get_all_diseases",
+}
+
+
+class name_index:
+    """
+    Sorted (folded name, name, id) arrays per kind, searched with bisect.
+    Prefix lookups are case-insensitive and never touch SQLite once loaded.
+    """
+
+    def __init__(self):
+        self.entries = {kind: [] for kind in SOURCES}
+        self.lock = threading.Lock()
+        self.db = None
+        self.reloads = reloader(self.load, "drugbase-names")
+
+    def load(self, db):
+        self.db = db
+        entries = {}
+        for kind, method in SOURCES.items():
+            rows = getattr(db, method)()
+            entries[kind] = sorted((name.casefold(), name, row_id) for row_id, name in rows if name is not None)
+        with self.lock:
+            self.entries = entries
+
+    def add(self, kind, row_id, name):
+        with self.lock:
+            bisect.insort(self.entries[kind], (name.casefold(), name, row_id))
+
+    def remove(self, kind, row_id):
+        with self.lock:
+            self.entries[kind] = [entry for entry in self.entries[kind] if entry[2] != row_id]
+
+    def search(self, prefix, kinds=None, limit=10):
+        """
+        Returns up to limit {"kind", "id", "name"} matches per kind, ordered by name.
+        """
+        folded = prefix.casefold()
+        results = []
+        for kind in kinds or SOURCES:
+            entries = self.entries[kind]
+            i = bisect.bisect_left(entries, (folded,))
+            end = min(i + limit, len(entries))
+            while i < end and entries[i][0].startswith(folded):
+                results.append({"kind": kind, "id": entries[i][2], "name": entries[i][1]})
+                i += 1
+        return results
+
+    def on_write(self, table, action, row):
+        """
+        Listener for sql.database writes, keeps the index current without a reload,
+        except after a write from another process, which reloads it in the background.
+        """
+        if table == "*":
+            self.reloads.request(self.db)
+            return
+        self.reloads.written()
+        if table == "NBDrugs" and action == "insert":
+            self.add("drug", row["DrugID"], row["Name"])
+        elif table == "NBDrugs" and action == "delete":
+            self.remove("drug", row["DrugID"])
+        elif table == "Generics" and action == "insert":
+            self.add("generic", row["GenID"], row["Name"])
+
+    def stats(self):
+        return {kind: len(entries) for kind, entries in self.entries.items()}
@@ -0,0 +1,198 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import config
+
+
+class connection_pool:
+    """
+    Many read-only connections plus a single serialized writer on one sqlite file.
+    The database is switched to WAL so readers never wait on a commit and
+    several uvicorn workers can share the same file.
+    """
+
+    def __init__(self, path=config.DB_PATH, size=config.READ_POOL_SIZE, timeout=config.POOL_TIMEOUT,
+                 max_streams=config.EXPORT_MAX_STREAMS):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.max_streams = max_streams
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+        self.streaming = 0
+
+        self.write_lock = threading.Lock()
+        self.writer = self._connect_writer()
+
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.create_lock = threading.Lock()
+
+        self.checkouts = 0
+        self.waits = 0
+        self.replaced = 0
+
+    def _configure(self, conn):
+        conn.execute("PRAGMA busy_timeout = %d" % int(config.BUSY_TIMEOUT * 1000))
+        conn.execute("PRAGMA cache_size = -%d" % config.CACHE_SIZE_KB)
+        conn.execute("PRAGMA mmap_size = %d" % config.MMAP_SIZE)
+
+    def _connect_writer(self):
+        conn = sqlite3.connect(self.path, timeout=config.BUSY_TIMEOUT, check_same_thread=False)
+        self._configure(conn)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _connect_reader(self):
+        uri = "file:%s?mode=ro" % quote(self.path)
+        conn = sqlite3.connect(uri, uri=True, timeout=config.BUSY_TIMEOUT, check_same_thread=False)
+        self._configure(conn)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _checkout(self):
+        self.checkouts += 1
+        try:
+            conn, last_used = self.idle.get_nowait()
+        except queue.Empty:
+            with self.create_lock:
+                if self.created < self.size:
+                    self.created += 1
+                    return self._connect_reader()
+            self.waits += 1
+            try:
+                conn, last_used = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError("no read connection available after %ss" % self.timeout)
+
+        if time.monotonic() - last_used > config.POOL_HEALTH_CHECK_INTERVAL and not self._healthy(conn):
+            conn = self._replace(conn)
+        return conn
+
+    def _replace(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self.replaced += 1
+        return self._connect_reader()
+
+    @contextmanager
+    def read(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            # a failed statement can leave the connection unusable, swap it out
+            if not self._healthy(conn):
+                conn = self._replace(conn)
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def stream(self):
+        """
+        A read-only connection of its own for a long export, opened outside the pool so a slow
+        download never holds a connection the searches need, at most max_streams at a time.
+        """
+        if not self.stream_slots.acquire(timeout=self.timeout):
+            raise TimeoutError("no export slot available after %ss" % self.timeout)
+        self.streaming += 1
+        try:
+            conn = self._connect_reader()
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            self.streaming -= 1
+            self.stream_slots.release()
+
+    @contextmanager
+    def write(self):
+        """
+        Hands out the writer connection and commits when the block finishes,
+        rolls back if it raised.
+        The transaction takes the database write lock up front (BEGIN IMMEDIATE), so ids read
+        inside the block cannot be taken by another process before the commit.
+        """
+        with self.write_lock:
+            try:
+                self.writer.execute("BEGIN IMMEDIATE")
+                yield self.writer
+                self.writer.commit()
+            except BaseException:
+                self.writer.rollback()
+                raise
+
+    def warm(self, statements):
+        """
+        Opens every read connection and runs each (query, params) on it, so the statements
+        are already prepared in every connection's statement cache. Returns the connection count.
+        """
+        conns = [self._checkout() for _ in range(self.size)]
+        try:
+            for conn in conns:
+                for query, params in statements:
+                    conn.execute(query, params).fetchall()
+        finally:
+            for conn in conns:
+                self.idle.put((conn, time.monotonic()))
+        return len(conns)
+
+    def health_check(self):
+        """
+        Pings every idle connection and the writer, replacing readers that fail.
+        """
+        checked = []
+        while True:
+            try:
+                checked.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        broken = 0
+        for conn, _ in checked:
+            if not self._healthy(conn):
+                broken += 1
+                conn = self._replace(conn)
+            self.idle.put((conn, time.monotonic()))
+        with self.write_lock:
+            writer_ok = self._healthy(self.writer)
+            if not writer_ok:
+                self.writer = self._connect_writer()
+        return {"readers_checked": len(checked), "readers_replaced": broken, "writer_ok": writer_ok}
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": self.created,
+            "idle": self.idle.qsize(),
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "replaced": self.replaced,
+            "streaming": self.streaming,
+        }
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        with self.write_lock:
+            self.writer.close()
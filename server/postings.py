@@ -0,0 +1,176 @@
+import bisect
+import threading
+from array import array
+
+from reloader import reloader
+
+
+def gallop(values, target, lo=0):
+    """
+    First position >= lo whose value is >= target, probing 1, 2, 4, ... ahead before the
+    bisect, so walking a long list with increasing targets costs O(log gap) per step.
+    """
+    n = len(values)
+    step = 1
+    hi = lo
+    while hi < n and values[hi] < target:
+        lo = hi + 1
+        hi = lo + step
+        step *= 2
+    return bisect.bisect_left(values, target, lo, min(hi, n))
+
+
+def intersect(postings, after=None):
+    """
+    Yields, in order, the ids found in every sorted posting, greater than after when given.
+    The shortest posting drives and the others are galloped through.
+    """
+    postings = sorted(postings, key=len)
+    smallest, rest = postings[0], postings[1:]
+    positions = [0] * len(rest)
+    start = 0 if after is None else bisect.bisect_right(smallest, after)
+    for value in smallest[start:]:
+        for j, other in enumerate(rest):
+            pos = positions[j] = gallop(other, value, positions[j])
+            if pos == len(other):
+                return
+            if other[pos] != value:
+                break
+        else:
+            yield value
+
+
+def contains(posting, value):
+    i = bisect.bisect_left(posting, value)
+    return i < len(posting) and posting[i] == value
+
+
+def price_key(price, drug_id):
+    # NULL prices sort last, like ORDER BY Price IS NULL, Price, DrugID
+    return (price is None, price or 0, drug_id)
+
+
+class disease_postings:
+    """
+    Per disease name, the sorted DrugIDs that treat it (array('q') posting lists) and the same
+    drugs as sorted price keys, plus each drug's name, price and cheapest generic. Answers
+    "which drugs treat every one of these diseases" by intersecting postings in memory instead
+    of joining Treatment once per disease.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.by_price = {}
+        self.disease_names = {}
+        self.drugs = {}
+        self.generics = {}
+        self.lock = threading.Lock()
+        self.db = None
+        self.reloads = reloader(self.load, "drugbase-postings")
+
+    def load(self, db):
+        self.db = db
+        tables = db.dev_read_catalog()
+        disease_names = dict(tables["Disease"])
+        drugs = {drug_id: [name, price, None] for drug_id, name, price, _ in tables["NBDrugs"]}
+        generics = {gen_id: (name, price) for gen_id, name, price in tables["Generics"]}
+
+        by_name = {}
+        for drug_id, disease_id in tables["Treatment"]:
+            if drug_id in drugs and disease_id in disease_names:
+                by_name.setdefault(disease_names[disease_id], set()).add(drug_id)
+        postings = {name: array("q", sorted(ids)) for name, ids in by_name.items()}
+        by_price = {name: sorted(price_key(drugs[drug_id][1], drug_id) for drug_id in ids)
+                    for name, ids in by_name.items()}
+
+        for drug_id, gen_id in tables["DrugAlt"]:
+            if drug_id in drugs:
+                self._offer(drugs[drug_id], gen_id, generics)
+        with self.lock:
+            self.postings = postings
+            self.by_price = by_price
+            self.disease_names = disease_names
+            self.drugs = drugs
+            self.generics = generics
+
+    @staticmethod
+    def _offer(drug, gen_id, generics):
+        # keeps the cheapest priced generic, ties to the lower GenID, the DrugSavings Rank 1 rule
+        generic = generics.get(gen_id)
+        if generic is None or generic[1] is None:
+            return
+        current = drug[2]
+        if current is None or (generic[1], gen_id) < (generics[current][1], current):
+            drug[2] = gen_id
+
+    def search(self, diseases, order="price", after=None, limit=10):
+        """
+        Up to limit (DrugName, DrugID, Price, GenName, GenID, GenPrice) rows of drugs treating
+        every disease named, by price or by DrugID, after the previous page's sort key.
+        """
+        with self.lock:
+            names = set(diseases)
+            if not names or any(name not in self.postings for name in names):
+                return []
+            ids = []
+            if order == "id":
+                for drug_id in intersect([self.postings[name] for name in names], after[0] if after else None):
+                    ids.append(drug_id)
+                    if len(ids) == limit:
+                        break
+            else:
+                # walks the smallest disease's price-ordered drugs, the others are probed by id
+                driver = min(names, key=lambda name: len(self.postings[name]))
+                others = [self.postings[name] for name in names if name != driver]
+                keys = self.by_price[driver]
+                for i in range(bisect.bisect_right(keys, tuple(after)) if after else 0, len(keys)):
+                    drug_id = keys[i][2]
+                    if all(contains(posting, drug_id) for posting in others):
+                        ids.append(drug_id)
+                        if len(ids) == limit:
+                            break
+            return [self._row(drug_id) for drug_id in ids]
+
+    def _row(self, drug_id):
+        name, price, gen_id = self.drugs[drug_id]
+        gen_name, gen_price = self.generics[gen_id] if gen_id is not None else (None, None)
+        return (name, drug_id, price, gen_name, gen_id, gen_price)
+
+    def on_write(self, table, action, row):
+        if table == "*":
+            # another process wrote to the file, nothing says what changed
+            self.reloads.request(self.db)
+            return
+        self.reloads.written()
+        with self.lock:
+            if table == "NBDrugs" and action == "insert":
+                self.drugs[row["DrugID"]] = [row["Name"], row["Price"], None]
+            elif table == "Generics" and action == "insert":
+                self.generics[row["GenID"]] = (row["Name"], row["Price"])
+            elif table == "DrugAlt" and action == "insert" and row["DrugID"] in self.drugs:
+                self._offer(self.drugs[row["DrugID"]], row["GenID"], self.generics)
+            elif table == "Treatment" and action == "insert":
+                name = self.disease_names.get(row["DiseaseID"])
+                if name is not None and row["DrugID"] in self.drugs:
+                    posting = self.postings.setdefault(name, array("q"))
+                    i = bisect.bisect_left(posting, row["DrugID"])
+                    if i == len(posting) or posting[i] != row["DrugID"]:
+                        posting.insert(i, row["DrugID"])
+                        bisect.insort(self.by_price.setdefault(name, []),
+                                      price_key(self.drugs[row["DrugID"]][1], row["DrugID"]))
+            elif table == "NBDrugs" and action == "delete":
+                drug_id = row["DrugID"]
+                drug = self.drugs.pop(drug_id, None)
+                if drug is None:
+                    return
+                key = price_key(drug[1], drug_id)
+                for name, posting in self.postings.items():
+                    i = bisect.bisect_left(posting, drug_id)
+                    if i < len(posting) and posting[i] == drug_id:
+                        del posting[i]
+                        keys = self.by_price[name]
+                        del keys[bisect.bisect_left(keys, key)]
+
+    def stats(self):
+        return {"diseases": len(self.postings), "drugs": len(self.drugs),
+                "postings": sum(len(posting) for posting in self.postings.values())}
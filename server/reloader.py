@@ -0,0 +1,48 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class reloader:
+    """
+    Runs load(db) on a background thread, for in-memory indexes told that another process
+    wrote to the database (the ("*", "external") notification), so the listener returns at
+    once instead of rebuilding on whichever thread checked the data version.
+    A reload asked for, or a local write seen, while one runs means one more run after it,
+    the running one may have read the tables before that write.
+    """
+
+    def __init__(self, load, name):
+        self.load = load
+        self.name = name
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = False
+        self.reloads = 0
+
+    def request(self, db):
+        with self.lock:
+            if self.running:
+                self.pending = True
+                return
+            self.running = True
+        threading.Thread(target=self._run, args=(db,), name=self.name, daemon=True).start()
+
+    def written(self):
+        with self.lock:
+            if self.running:
+                self.pending = True
+
+    def _run(self, db):
+        while True:
+            try:
+                self.load(db)
+                self.reloads += 1
+            except Exception:
+                log.exception("%s reload failed, keeping the previous index", self.name)
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                self.pending = False
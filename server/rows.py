@@ -0,0 +1,132 @@
+"""
+Typed row models for what the endpoints return and a JSON response that skips jsonable_encoder.
+sql.database keeps returning plain tuples (they are what the cache and the snapshot hold),
+the models name their columns, in the same order and with the same names as the query aliases.
+Version 1 responses keep the positional arrays the frontends index into, version 2 rows are
+objects keyed by field name.
+"""
+
+import json
+from typing import NamedTuple, Optional
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    # optional, the stdlib encoder writes the same JSON, only slower
+    orjson = None
+
+VERSIONS = (1, 2)
+
+
+class DrugSearchRow(NamedTuple):
+    name: str
+    drugID: int
+    genID: int
+    diseases: str
+    gPrice: Optional[int]
+    dPrice: Optional[int]
+    gName: str
+
+
+class DiseaseSearchRow(NamedTuple):
+    GenName: str
+    DiseaseID: int
+    Gprice: Optional[int]
+    DrugPrice: Optional[int]
+    drugID: int
+    DiseaseName: str
+    DrugName: str
+
+
+class MultiDiseaseRow(NamedTuple):
+    Name: str
+    DrugID: int
+    disease_count: int
+    diseases: str
+    manufacturer: str
+    Price: Optional[int]
+
+
+class SavingsRow(NamedTuple):
+    DrugName: str
+    DrugID: int
+    GenName: str
+    GenID: int
+    DrugPrice: int
+    GenPrice: int
+    Savings: int
+    SavingsPct: Optional[float]
+
+
+class AlternativeRow(NamedTuple):
+    DrugName: str
+    DrugID: int
+    GenName: str
+    GenID: int
+    DrugPrice: int
+    GenPrice: int
+    Savings: int
+    SavingsPct: Optional[float]
+    Rank: int
+
+
+class IntersectionRow(NamedTuple):
+    DrugName: str
+    DrugID: int
+    Price: Optional[int]
+    GenName: Optional[str]
+    GenID: Optional[int]
+    GenPrice: Optional[int]
+
+
+class DescriptionRow(NamedTuple):
+    Purpose: Optional[str]
+
+
+class ManufacturerRow(NamedTuple):
+    ManID: int
+    Name: str
+
+
+class DiseaseRow(NamedTuple):
+    DiseaseID: int
+    Name: str
+
+
+class DrugNameRow(NamedTuple):
+    DrugID: int
+    Name: str
+
+
+class GenericNameRow(NamedTuple):
+    GenID: int
+    Name: str
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def shape(rows, model, version=1):
+    """
+    rows as version expects them: the tuples themselves for 1, {field: value} objects for 2
+    """
+    if version == 1 or model is None:
+        return rows
+    fields = model._fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class json_response(Response):
+    """
+    Serialized with orjson when it is installed, content must already be plain
+    lists/tuples/dicts, nothing is converted on the way.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
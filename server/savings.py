@@ -0,0 +1,76 @@
+"""
+DrugSavings keeps, per brand drug, its generic alternatives ranked cheapest first with the
+absolute and percentage saving, so savings lookups are index seeks instead of the
+NBDrugs/DrugAlt/Generics join. DiseaseSavings files each drug's best saving under every
+disease it treats, for the per-disease ranking. Like MultiDiseaseSummary it is kept current inside the
+same transaction as the dev_* write that changes it.
+"""
+
+SAVINGS_SELECT = """
+    SELECT nbd.DrugID, g.GenID, nbd.Price, g.Price, nbd.Price - g.Price,
+           CASE WHEN nbd.Price > 0 THEN ROUND((nbd.Price - g.Price) * 100.0 / nbd.Price, 2) END,
+           ROW_NUMBER() OVER (PARTITION BY nbd.DrugID ORDER BY g.Price ASC, g.GenID ASC)
+    FROM NBDrugs AS nbd
+    JOIN DrugAlt AS da ON da.DrugID = nbd.DrugID
+    JOIN Generics AS g ON g.GenID = da.GenID
+    WHERE nbd.Price IS NOT NULL AND g.Price IS NOT NULL
+"""
+
+
+def create_drug_savings(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS DrugSavings (
+            DrugID INTEGER NOT NULL,
+            GenID INTEGER NOT NULL,
+            DrugPrice INTEGER,
+            GenPrice INTEGER,
+            Savings INTEGER,
+            SavingsPct REAL,
+            Rank INTEGER NOT NULL,
+            PRIMARY KEY (DrugID, Rank)
+            ) WITHOUT ROWID""")
+
+
+def create_disease_savings(cur):
+    # the Rank 1 row of every drug once per disease it treats, in the order /Top_Savings
+    # pages through, so a page is a seek on the primary key
+    cur.execute("""CREATE TABLE IF NOT EXISTS DiseaseSavings (
+            DiseaseName TEXT NOT NULL,
+            Savings INTEGER NOT NULL,
+            DrugID INTEGER NOT NULL,
+            GenID INTEGER NOT NULL,
+            DrugPrice INTEGER,
+            GenPrice INTEGER,
+            SavingsPct REAL,
+            PRIMARY KEY (DiseaseName, Savings DESC, DrugID)
+            ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_disease_savings_drugid ON DiseaseSavings (DrugID)")
+
+
+# OR IGNORE: two diseases with the same name list a drug once, like the old IN (...) did
+DISEASE_SAVINGS_INSERT = """
+    INSERT OR IGNORE INTO DiseaseSavings
+    SELECT d.Name, s.Savings, s.DrugID, s.GenID, s.DrugPrice, s.GenPrice, s.SavingsPct
+    FROM DrugSavings AS s
+    JOIN Treatment AS t ON t.DrugID = s.DrugID
+    JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
+    WHERE s.Rank = 1
+"""
+
+
+def rebuild_drug_savings(cur):
+    cur.execute("DELETE FROM DrugSavings")
+    cur.execute("INSERT INTO DrugSavings " + SAVINGS_SELECT)
+    return cur.execute("SELECT COUNT(*) FROM DrugSavings").fetchone()[0]
+
+
+def rebuild_disease_savings(cur):
+    # reads DrugSavings, rebuild that first
+    cur.execute("DELETE FROM DiseaseSavings")
+    cur.execute(DISEASE_SAVINGS_INSERT)
+
+
+def refresh_drug_savings(cur, drug_id):
+    cur.execute("DELETE FROM DrugSavings WHERE DrugID = ?", (drug_id,))
+    cur.execute("INSERT INTO DrugSavings " + SAVINGS_SELECT + " AND nbd.DrugID = ?", (drug_id,))
+    cur.execute("DELETE FROM DiseaseSavings WHERE DrugID = ?", (drug_id,))
+    cur.execute(DISEASE_SAVINGS_INSERT + " AND s.DrugID = ?", (drug_id,))
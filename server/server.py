@@ -1,11 +1,257 @@
-from fastapi import FastAPI, HTTPException
+import csv
+import io
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.routing import Match
 import sql
+from async_db import async_database
+from cache import result_cache
+from cursor import NUMBER, decode_cursor, encode_cursor
+from instrument import counter, histogram
+from limits import retry_after, single_flight, token_buckets
+from fuzzy import trigram_index
+from names import name_index
+from postings import disease_postings, price_key
+from rows import (VERSIONS, AlternativeRow, DescriptionRow, DiseaseRow, DiseaseSearchRow, DrugNameRow,
+                  DrugSearchRow, GenericNameRow, IntersectionRow, ManufacturerRow, MultiDiseaseRow, SavingsRow,
+                  dumps, json_response, shape)
+from snapshot import catalog_snapshot
+import config
+
+# built by startup() when the app starts, so importing server stays cheap and a bad
+# DRUGBASE_DB_PATH fails the worker's startup instead of its first request
+db = None
+cache = None
+client = None
+names = None
+fuzzy = None
+intersections = None
+snapshot = None
+startup_report = None
+cheap_limits = None
+expensive_limits = None
+flights = None
+
+def startup():
+    global db, cache, client, names, fuzzy, intersections, snapshot, startup_report
+    global cheap_limits, expensive_limits, flights
+    start = time.perf_counter()
+    db = sql.database()
+    cache = result_cache()
+    db.subscribe(cache.on_write)
+    client = async_database(db, cache=cache)
+
+    names = name_index()
+    names.load(db)
+    db.subscribe(names.on_write)
+
+    fuzzy = trigram_index()
+    fuzzy.load(db)
+    db.subscribe(fuzzy.on_write)
+
+    intersections = disease_postings()
+    intersections.load(db)
+    db.subscribe(intersections.on_write)
+
+    if config.SNAPSHOT:
+        snapshot = catalog_snapshot()
+        db.subscribe(snapshot.on_write)
+        snapshot.start(db)
+
+    if config.RATE_LIMIT_CHEAP > 0:
+        cheap_limits = token_buckets(config.RATE_LIMIT_CHEAP, config.RATE_LIMIT_CHEAP_BURST)
+    if config.RATE_LIMIT_EXPENSIVE > 0:
+        expensive_limits = token_buckets(config.RATE_LIMIT_EXPENSIVE, config.RATE_LIMIT_EXPENSIVE_BURST)
+    flights = single_flight()
+
+    db.watch_data_version()
+
+    warmup = db.warm_up() if config.WARMUP else None
+    startup_report = {"db_path": os.path.abspath(db.path), "schema_version": db.schema_version,
+                      "warmup": warmup, "startup_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+def shutdown():
+    global startup_report
+    startup_report = None
+    if snapshot is not None:
+        snapshot.close()
+    client.close()
+    db.close()
+
+@asynccontextmanager
+async def lifespan(app):
+    startup()
+    try:
+        yield
+    finally:
+        shutdown()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
+# GET routes whose body only depends on the url and the catalog data, they get ETags
+CACHEABLE_ROUTES = {
+    "/Drug_Search/{IDFrom}/{QueryName}",
+    "/Disease_Search/{IDFrom}/{QueryName}",
+    "/Multi_Disease_Treatment/{IDFrom}/{MinDiseases}",
+    "/Top_Savings/{DiseaseName}",
+    "/Cheapest_Alternative/{DrugName}",
+    "/Fuzzy_Search/{kind}/{QueryName}",
+    "/Disease_Intersection",
+    "/autocomplete/{prefix}",
+    "/desc/{name}",
+    "/dev/manufacturers",
+    "/dev/diseases",
+    "/dev/drugs",
+    "/dev/generics",
+    "/export/{table}",
+}
+CACHE_CONTROL = "public, max-age=%d, must-revalidate" % config.HTTP_CACHE_MAX_AGE
+
+# searches whose identical concurrent requests share one execution, their responses are
+# small enough to buffer (the streaming exports and dumps are not in here)
+COALESCED_ROUTES = {
+    "/Drug_Search/{IDFrom}/{QueryName}",
+    "/Disease_Search/{IDFrom}/{QueryName}",
+    "/Multi_Disease_Treatment/{IDFrom}/{MinDiseases}",
+    "/Top_Savings/{DiseaseName}",
+    "/Cheapest_Alternative/{DrugName}",
+    "/Fuzzy_Search/{kind}/{QueryName}",
+    "/Disease_Intersection",
+    "/autocomplete/{prefix}",
+    "/desc/{name}",
+}
+# rate limited with the expensive budget, as is everything under /dev/
+EXPENSIVE_ROUTES = {
+    "/Multi_Disease_Treatment/{IDFrom}/{MinDiseases}",
+    "/Fuzzy_Search/{kind}/{QueryName}",
+    "/Disease_Intersection",
+    "/export/{table}",
+}
+# never limited or shed, operators need them most when the API is overloaded
+EXEMPT_ROUTES = {"/", "/ready", "/metrics", "/dev/db_stats"}
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match compares weakly, W/"x" matches "x"
+    return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+def match_route(scope):
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+def route_of(request):
+    # matched once per request, the middlewares below all need it before the router runs
+    if "drugbase.route" not in request.scope:
+        request.scope["drugbase.route"] = match_route(request.scope)
+    return request.scope["drugbase.route"]
+
+async def buffered(response):
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    return response.status_code, response.raw_headers, body
+
+@app.middleware("http")
+async def coalesce(request: Request, call_next):
+    """
+    Single-flight: identical GETs on the search routes that arrive while one is running wait
+    for its response instead of running the same queries again
+    """
+    if not config.SINGLE_FLIGHT or request.method != "GET":
+        return await call_next(request)
+    route = route_of(request)
+    if route is None or route.path not in COALESCED_ROUTES:
+        return await call_next(request)
+    key = (request.url.path, request.url.query, db.current_data_version())
+
+    async def run():
+        return await buffered(await call_next(request))
+
+    status, raw_headers, body = await flights.do(key, run)
+    request.scope["route"] = route
+    response = Response(content=body, status_code=status)
+    response.raw_headers = list(raw_headers)
+    return response
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    Strong ETags on the read routes, built from the schema and data versions, so a repeat
+    request with a matching If-None-Match is answered 304 before any query runs
+    """
+    if request.method not in ("GET", "HEAD"):
+        return await call_next(request)
+    route = route_of(request)
+    if route is None or route.path not in CACHEABLE_ROUTES:
+        return await call_next(request)
+    headers = {"ETag": '"%d-%d"' % (db.schema_version, db.current_data_version()), "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        # lets record_request label the 304 with its route
+        request.scope["route"] = route
+        return Response(status_code=304, headers=headers)
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+http_rejected = counter("drugbase_http_rejected_total", "Requests refused by admission control", ("reason",))
+
+def reject(request, route, status_code, reason, seconds):
+    request.scope["route"] = route
+    http_rejected.inc((reason,))
+    return json_response({"detail": reason}, status_code=status_code, headers={"Retry-After": retry_after(seconds)})
+
+@app.middleware("http")
+async def admission(request: Request, call_next):
+    """
+    Sheds load with 503 while the database queue is past SHED_QUEUE_DEPTH, then applies the
+    client's token bucket, the expensive one for costly routes, answering 429 when it is empty.
+    Both carry Retry-After so well behaved clients back off instead of piling on.
+    """
+    route = route_of(request)
+    if route is None or route.path in EXEMPT_ROUTES:
+        return await call_next(request)
+    if config.SHED_QUEUE_DEPTH and client.queued >= config.SHED_QUEUE_DEPTH:
+        return reject(request, route, 503, "overloaded", config.SHED_RETRY_AFTER)
+    expensive = route.path in EXPENSIVE_ROUTES or route.path.startswith("/dev/")
+    limits = expensive_limits if expensive else cheap_limits
+    if limits is not None:
+        wait = limits.take(request.client.host if request.client is not None else "unknown")
+        if wait:
+            return reject(request, route, 429, "rate limited", wait)
+    return await call_next(request)
+
+http_requests = counter("drugbase_http_requests_total", "Requests served", ("method", "route", "status"))
+http_latency = histogram("drugbase_http_request_duration_seconds", "Time to build a response", ("route",))
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # label by route template so /desc/{name} stays one series whatever the name
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_latency.observe((path,), time.perf_counter() - start)
+    http_requests.inc((request.method, path, response.status_code))
+    return response
+
+# added last so it is the outermost layer: the 429/503 from admission get CORS headers the
+# browser frontend needs to read Retry-After, and coalesced responses, shared between
+# requests from different origins, never carry another request's Access-Control-Allow-Origin
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -14,77 +260,413 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],
 )
 
-
-client = sql.database()
-
 @app.get("/")
 async def root():
     return {"message" : "This is the drugbase API"}
 
+def read_version(v):
+    if v not in VERSIONS:
+        raise HTTPException(status_code=400, detail="v must be one of %s" % ", ".join(map(str, VERSIONS)))
+    return v
+
+def page(rows, key, model=None, v=1):
+    """
+    Wraps a page of search rows with the cursor for the next page, None on the last page
+    v=1 rows are positional arrays, v=2 rows are objects keyed by the model's fields
+    """
+    next_cursor = encode_cursor(key(rows[-1])) if len(rows) == sql.PAGE_SIZE else None
+    return json_response({"data": shape(rows, model, read_version(v)), "next_cursor": next_cursor})
+
+async def search(tables, name, *args):
+    """
+    Rows of a sql.database search, from the in-memory snapshot when it is enabled and
+    current, otherwise through the result cache
+    """
+    if snapshot is not None:
+        rows = snapshot.search(name, *args)
+        if rows is not None:
+            return rows
+    return await client.cached(tables, name, *args)
+
+def read_cursor(token, size, types=None):
+    if token is None:
+        return None
+    try:
+        return decode_cursor(token, size, types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/Drug_Search/{IDFrom}/{QueryName}")
-async def get_next_six_drugs(IDFrom: int, QueryName: str):
-    return {"data" : client.Drug_Search_Mode_six(IDFrom, QueryName)}
-    #Remember this will contain the greated id
-    #In case user wants to see next without changing the name
+async def get_next_six_drugs(IDFrom: int, QueryName: str, cursor: str = None, v: int = 1):
+    after = read_cursor(cursor, 2)
+    rows = await search(sql.SEARCH_TABLES, "Drug_Search_Mode_six", IDFrom, QueryName, after)
+    return page(rows, lambda row: (row[1], row[6]), DrugSearchRow, v)
+    #Pass next_cursor back to get the next page without changing the name,
+    #IDFrom is only used when there is no cursor
     
 @app.get("/Disease_Search/{IDFrom}/{QueryName}")
-async def get_next_six_disease(IDFrom: int, QueryName: str):
-    return {"data" : client.Disease_Search_Mode_six(IDFrom, QueryName)}
+async def get_next_six_disease(IDFrom: int, QueryName: str, cursor: str = None, v: int = 1):
+    after = read_cursor(cursor, 3)
+    rows = await search(sql.SEARCH_TABLES, "Disease_Search_Mode_six", IDFrom, QueryName, after)
+    return page(rows, lambda row: (row[4], row[1], row[0]), DiseaseSearchRow, v)
 
 @app.get("/Multi_Disease_Treatment/{IDFrom}/{MinDiseases}")
-async def get_multi_disease_treatments(IDFrom: int, MinDiseases: int = 2):
+async def get_multi_disease_treatments(IDFrom: int, MinDiseases: int = 2, cursor: str = None, v: int = 1):
     """
     Get drugs that treat multiple diseases
-    Uses HAVING clause to filter drugs that treat at least MinDiseases different diseases
+    Answered from the MultiDiseaseSummary table, kept current by the dev_* writes
+    """
+    after = read_cursor(cursor, 2)
+    rows = await search(sql.MULTI_DISEASE_TABLES, "Multi_Disease_Treatment_Search", IDFrom, MinDiseases, after)
+    return page(rows, lambda row: (row[2], row[1]), MultiDiseaseRow, v)
+
+@app.get("/Top_Savings/{DiseaseName}")
+async def get_top_savings(DiseaseName: str, cursor: str = None, v: int = 1):
+    """
+    Drugs treating DiseaseName with their cheapest generic, biggest saving first,
+    answered from the precomputed DrugSavings table
+    """
+    after = read_cursor(cursor, 2)
+    rows = await client.cached(sql.SAVINGS_TABLES, "Top_Savings_For_Disease", DiseaseName, after)
+    return page(rows, lambda row: (row[6], row[1]), SavingsRow, v)
+
+@app.get("/Cheapest_Alternative/{DrugName}")
+async def get_cheapest_alternative(DrugName: str, count: int = 1, v: int = 1):
+    """
+    The count cheapest generics of a brand drug with what each saves
     """
-    return {"data": client.Multi_Disease_Treatment_Search(IDFrom, MinDiseases)}
+    if count < 1:
+        raise HTTPException(status_code=400, detail="count must be at least 1")
+    rows = await client.cached(sql.SAVINGS_TABLES, "Cheapest_Alternatives", DrugName, count)
+    return json_response({"data": shape(rows, AlternativeRow, read_version(v))})
 
+@app.get("/Disease_Intersection")
+async def disease_intersection(disease: List[str] = Query(...), order: str = "price", cursor: str = None,
+                               v: int = 1):
+    """
+    Drugs that treat every disease given (?disease=Flu&disease=Cold) with their cheapest generic,
+    cheapest first (order=price) or by DrugID (order=id), answered by intersecting
+    in-memory per-disease posting lists
+    """
+    if order not in ("price", "id"):
+        raise HTTPException(status_code=400, detail="order must be price or id")
+    if len(disease) > config.INTERSECTION_MAX_DISEASES:
+        raise HTTPException(status_code=400, detail="at most %d diseases" % config.INTERSECTION_MAX_DISEASES)
+    if order == "price":
+        after = read_cursor(cursor, 3, (bool, NUMBER, int))
+    else:
+        after = read_cursor(cursor, 1, (int,))
+    rows = await client.run(intersections.search, disease, order, after, sql.PAGE_SIZE)
+    key = (lambda row: price_key(row[2], row[1])) if order == "price" else (lambda row: (row[1],))
+    return page(rows, key, IntersectionRow, v)
+
+@app.get("/Fuzzy_Search/{kind}/{QueryName}")
+async def fuzzy_search(kind: str, QueryName: str, cursor: str = None):
+    """
+    Typo tolerant, mid-word search over drug, generic or disease names,
+    ranked by trigram similarity and paged with next_cursor like the other searches
+    """
+    if kind not in ("drug", "generic", "disease"):
+        raise HTTPException(status_code=400, detail="kind must be drug, generic or disease")
+    after = read_cursor(cursor, 2, (NUMBER, int))
+    matches = await client.run(fuzzy.search, QueryName, kind, sql.PAGE_SIZE, after)
+    rows = [{"kind": kind, "id": row_id, "name": name, "score": score} for score, row_id, name in matches]
+    return page(rows, lambda row: (row["score"], row["id"]))
+
+@app.get("/autocomplete/{prefix}")
+async def autocomplete(prefix: str, limit: int = config.AUTOCOMPLETE_LIMIT, kind: str = None):
+    """
+    Case-insensitive name completion for drugs, generics and diseases,
+    answered from the in-memory name index
+    """
+    if kind is not None and kind not in ("drug", "generic", "disease"):
+        raise HTTPException(status_code=400, detail="kind must be drug, generic or disease")
+    limit = max(1, min(limit, config.AUTOCOMPLETE_MAX_LIMIT))
+    return {"data": names.search(prefix, [kind] if kind else None, limit)}
+
+@app.get("/ready")
+async def ready():
+    """
+    200 once startup has opened and validated the database and warmed it up, 503 before that
+    and while shutting down
+    """
+    if startup_report is None:
+        return json_response({"ready": False}, status_code=503)
+    return json_response(dict(startup_report, ready=True, data_version=db.current_data_version(),
+                              snapshot_fresh=snapshot.fresh() if snapshot is not None else None))
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text exposition of request, query, executor and cache metrics
+    """
+    lines = http_requests.render() + http_latency.render() + http_rejected.render()
+    if db.instrument is not None:
+        lines += db.instrument.render()
+    gauges = {
+        "drugbase_db_queue_depth": ("Database calls waiting for a worker", client.queued),
+        "drugbase_db_running": ("Database calls running", client.running),
+        "drugbase_result_cache_entries": ("Entries in the result cache", len(cache.entries)),
+    }
+    for name, (help_text, value) in gauges.items():
+        lines += ["# HELP %s %s" % (name, help_text), "# TYPE %s gauge" % name, "%s %d" % (name, value)]
+    for name, value in (("hits", cache.hits), ("misses", cache.misses), ("evictions", cache.evictions)):
+        metric = "drugbase_result_cache_%s_total" % name
+        lines += ["# TYPE %s counter" % metric, "%s %d" % (metric, value)]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/dev/slow_queries")
+async def get_slow_queries():
+    return {"data": list(db.instrument.slow_log) if db.instrument is not None else []}
+
+@app.get("/dev/db_stats")
+async def get_db_stats():
+    return {"data": {"executor": client.stats(), "pool": db.pool.stats(), "cache": cache.stats(),
+                     "intersections": intersections.stats(),
+                     "limits": {"cheap": cheap_limits.stats() if cheap_limits is not None else None,
+                                "expensive": expensive_limits.stats() if expensive_limits is not None else None,
+                                "single_flight": flights.stats()},
+                     "snapshot": snapshot.stats() if snapshot is not None else None}}
+
+@app.get("/dev/snapshot/check")
+async def check_snapshot():
+    """
+    Compares every search answered from the snapshot with the same search in SQL
+    """
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="snapshot is disabled, set DRUGBASE_SNAPSHOT=1")
+    try:
+        return {"data": await client.run(snapshot.check, db)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": retry_after(config.SNAPSHOT_RELOAD_DELAY)})
+
+@app.get("/dev/db_health")
+async def get_db_health():
+    return {"data": await client.dev_pool_health()}
+
+def stream_json_rows(batches, model, v=1):
+    """
+    Streams {"data": [...]}, the shape the /dev/* dumps always had, one batch at a time
+    """
+    yield b'{"data":['
+    first = True
+    for batch in batches:
+        # the batch's array without its brackets
+        chunk = dumps(shape(batch, model, v))[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]}"
+
+def stream_ndjson(batches, columns):
+    for batch in batches:
+        yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in batch)
+
+def stream_csv(batches, columns):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode()
+
+def table_batches(export, columns=None, **filters):
+    if db.pool.streaming >= db.pool.max_streams:
+        raise HTTPException(status_code=503, detail="too many exports running",
+                            headers={"Retry-After": retry_after(config.SHED_RETRY_AFTER)})
+    try:
+        return db.dev_iter_table(export, columns, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# same columns as before, but streamed from the cursor instead of one fetchall()
 @app.get("/dev/manufacturers")
-async def get_manufacturers():
-    return {"data": client.dev_get_all_manufacturers()}
+async def get_manufacturers(v: int = 1):
+    return StreamingResponse(stream_json_rows(table_batches("manufacturers"), ManufacturerRow, read_version(v)),
+                             media_type="application/json")
 
 @app.get("/dev/diseases")
-async def get_diseases():
-    return {"data": client.dev_get_all_diseases()}
+async def get_diseases(v: int = 1):
+    return StreamingResponse(stream_json_rows(table_batches("diseases"), DiseaseRow, read_version(v)),
+                             media_type="application/json")
 
 @app.get("/dev/drugs")
-async def get_drugs():
-    return {"data": client.dev_get_all_drugs()}
+async def get_drugs(v: int = 1):
+    return StreamingResponse(stream_json_rows(table_batches("drugs", DrugNameRow._fields), DrugNameRow,
+                                              read_version(v)), media_type="application/json")
 
 @app.get("/dev/generics")
-async def get_generics():
-    return {"data": client.dev_get_all_generics()}
+async def get_generics(v: int = 1):
+    return StreamingResponse(stream_json_rows(table_batches("generics", GenericNameRow._fields), GenericNameRow,
+                                              read_version(v)), media_type="application/json")
+
+@app.get("/export/{table}")
+async def export_table(table: str, format: str = "ndjson", columns: str = None, name_prefix: str = None,
+                       min_price: float = None, max_price: float = None):
+    """
+    Streams a whole table as NDJSON or CSV with constant memory
+    columns is a comma separated list, name_prefix and min_price/max_price filter the rows
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    if table not in sql.EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="unknown table %s" % table)
+    selected = columns.split(",") if columns else list(sql.EXPORT_TABLES[table][2])
+    batches = table_batches(table, selected, name_prefix=name_prefix, min_price=min_price, max_price=max_price)
+    if format == "csv":
+        return StreamingResponse(stream_csv(batches, selected), media_type="text/csv",
+                                 headers={"Content-Disposition": 'attachment; filename="%s.csv"' % table})
+    return StreamingResponse(stream_ndjson(batches, selected), media_type="application/x-ndjson")
 
 @app.get("/desc/{name}")
-async def get_description(name):
-    return {"data": client.Get_Description_Drug(name)}
+async def get_description(name, v: int = 1):
+    rows = await client.cached(sql.DESCRIPTION_TABLES, "Get_Description_Drug", name)
+    return json_response({"data": shape(rows, DescriptionRow, read_version(v))})
+
+class DrugBatch(BaseModel):
+    names: list[str] = []
+    ids: list[int] = []
+
+def check_batch_size(count, limit=config.BATCH_MAX_ITEMS):
+    if count > limit:
+        raise HTTPException(status_code=413, detail="at most %d items per batch" % limit)
+
+@app.post("/desc/batch")
+async def get_descriptions(batch: DrugBatch):
+    """
+    /desc/{name} for a whole page of results, keyed by drug name
+    """
+    check_batch_size(len(batch.names))
+    return {"data": await client.Get_Description_Drugs(batch.names)}
+
+@app.post("/drugs/batch")
+async def get_drug_details(batch: DrugBatch):
+    """
+    Description, price and generic alternatives for many drugs in one call,
+    keyed by the names and ids that were asked for
+    """
+    check_batch_size(len(batch.names) + len(batch.ids))
+    by_name, by_id = await client.Get_Drug_Details(batch.names, batch.ids)
+    return {"data": {"names": by_name, "ids": by_id}}
 
 @app.post("/dev/manufacturer")
 async def add_manufacturer(name: str):
-    new_id = client.dev_insert_manufacturer(name)
+    new_id = await client.dev_insert_manufacturer(name)
     return {"success": True, "id": new_id}
 
 @app.post("/dev/drug")
 async def add_drug(name: str, price: int, purpose: str, man_id: int):
-    new_id = client.dev_insert_drug(name, price, purpose, man_id)
+    new_id = await client.dev_insert_drug(name, price, purpose, man_id)
     return {"success": True, "id": new_id}
 
 @app.post("/dev/generic")
 async def add_generic(name: str, price: int, purpose: str):
-    new_id = client.dev_insert_generic(name, price, purpose)
+    new_id = await client.dev_insert_generic(name, price, purpose)
     return {"success": True, "id": new_id}
 
 @app.post("/dev/treatment")
 async def add_treatment(disease_id: int, drug_id: int, gen_id: int):
-    success = client.dev_insert_treatment(disease_id, drug_id, gen_id)
+    success = await client.dev_insert_treatment(disease_id, drug_id, gen_id)
     return {"success": success}
 
+class ManufacturerIn(BaseModel):
+    name: str
+
+class DrugIn(BaseModel):
+    name: str
+    price: int
+    purpose: str
+    man_id: int
+
+class GenericIn(BaseModel):
+    name: str
+    price: int
+    purpose: str
+
+class TreatmentIn(BaseModel):
+    disease_id: int
+    drug_id: int
+    gen_id: int
+
+async def read_records(request: Request, model):
+    """
+    Body is either a JSON array or NDJSON (one object per line, Content-Type application/x-ndjson),
+    NDJSON is parsed as it streams in. Bodies over BULK_MAX_BYTES and NDJSON over BULK_MAX_ITEMS
+    records are refused as soon as they get there, not once they are fully read.
+    """
+    ndjson = request.headers.get("content-type", "").startswith("application/x-ndjson")
+    records, pending, size = [], b"", 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > config.BULK_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="body over %d bytes" % config.BULK_MAX_BYTES)
+            if not ndjson:
+                pending += chunk
+                continue
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            records.extend(json.loads(line) for line in lines if line.strip())
+            check_batch_size(len(records), config.BULK_MAX_ITEMS)
+        if not ndjson:
+            records = json.loads(pending)
+        elif pending.strip():
+            records.append(json.loads(pending))
+    except ValueError as e:
+        # JSONDecodeError, or UnicodeDecodeError for a body that is not UTF-8
+        raise HTTPException(status_code=400, detail="invalid JSON: %s" % e)
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="expected a JSON array or NDJSON")
+    check_batch_size(len(records), config.BULK_MAX_ITEMS)
+    try:
+        return [model.model_validate(record) for record in records]
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+
+@app.post("/dev/bulk/manufacturers")
+async def bulk_add_manufacturers(request: Request):
+    records = await read_records(request, ManufacturerIn)
+    ids = await client.dev_bulk_insert_manufacturers([r.name for r in records])
+    return {"success": True, "ids": ids}
+
+@app.post("/dev/bulk/drugs")
+async def bulk_add_drugs(request: Request):
+    records = await read_records(request, DrugIn)
+    ids = await client.dev_bulk_insert_drugs([(r.name, r.price, r.purpose, r.man_id) for r in records])
+    return {"success": True, "ids": ids}
+
+@app.post("/dev/bulk/generics")
+async def bulk_add_generics(request: Request):
+    records = await read_records(request, GenericIn)
+    ids = await client.dev_bulk_insert_generics([(r.name, r.price, r.purpose) for r in records])
+    return {"success": True, "ids": ids}
+
+@app.post("/dev/bulk/treatments")
+async def bulk_add_treatments(request: Request):
+    records = await read_records(request, TreatmentIn)
+    count = await client.dev_bulk_insert_treatments([(r.disease_id, r.drug_id, r.gen_id) for r in records])
+    return {"success": True, "count": count}
+
 @app.put("/dev/manufacturer/{man_id}")
 async def update_manufacturer(man_id: int, new_name: str):
-    success = client.dev_update_manufacturer_name(man_id, new_name)
+    success = await client.dev_update_manufacturer_name(man_id, new_name)
     return {"success": success}
 
+@app.post("/dev/rebuild/multi_disease")
+async def rebuild_multi_disease_summary():
+    count = await client.dev_rebuild_multi_disease_summary()
+    return {"success": True, "rows": count}
+
+@app.post("/dev/rebuild/savings")
+async def rebuild_drug_savings():
+    count = await client.dev_rebuild_drug_savings()
+    return {"success": True, "rows": count}
+
 @app.delete("/dev/drug/{drug_id}")
 async def delete_drug(drug_id: int):
-    success = client.dev_delete_drug_cascade(drug_id)
+    success = await client.dev_delete_drug_cascade(drug_id)
     return {"success": success}
@@ -0,0 +1,368 @@
+import bisect
+import collections
+import heapq
+import logging
+import sys
+import threading
+import time
+from array import array
+
+import config
+import sql
+from migrations import prefix_range
+
+log = logging.getLogger(__name__)
+
+# stands in for a NULL price inside the int64 price columns
+NULL = -2 ** 63
+
+
+def _intern(value):
+    return None if value is None else sys.intern(value)
+
+
+def _price(value):
+    return None if value == NULL else value
+
+
+def _csr(pairs, count):
+    """
+    Compressed sparse rows from (row, target) pairs sorted by row,
+    the targets of row i are targets[offsets[i]:offsets[i + 1]]
+    """
+    offsets = array("q", bytes(8 * (count + 1)))
+    targets = array("q")
+    for row, target in pairs:
+        offsets[row + 1] += 1
+        targets.append(target)
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+    return offsets, targets
+
+
+def _after(key, after):
+    # sql row value comparison, key > after, where a NULL in after compares as unknown (false)
+    for k, a in zip(key, after):
+        if a is None:
+            return False
+        if k != a:
+            return k > a
+    return False
+
+
+class catalog:
+    """
+    One immutable load of the catalog tables: column arrays indexed by row position
+    (rows are in id order), interned strings, and CSR adjacency for Treatment and DrugAlt.
+    The searches return exactly the rows of the matching sql.database queries.
+    """
+
+    def __init__(self, tables):
+        manufacturers = {man_id: _intern(name) for man_id, name in tables["Manufacturer"]}
+
+        drugs = tables["NBDrugs"]
+        self.drug_ids = array("q", (row[0] for row in drugs))
+        self.drug_names = [_intern(row[1]) for row in drugs]
+        self.drug_prices = array("q", (NULL if row[2] is None else row[2] for row in drugs))
+        # None when the drug's manufacturer is missing, the sql joins drop those drugs
+        self.drug_manufacturers = [manufacturers.get(row[3]) for row in drugs]
+
+        generics = tables["Generics"]
+        self.gen_ids = array("q", (row[0] for row in generics))
+        self.gen_names = [_intern(row[1]) for row in generics]
+        self.gen_prices = array("q", (NULL if row[2] is None else row[2] for row in generics))
+
+        diseases = tables["Disease"]
+        self.disease_ids = array("q", (row[0] for row in diseases))
+        self.disease_names = [_intern(row[1]) for row in diseases]
+
+        # links to rows that do not exist are dropped, as the inner joins would
+        drug_rows = {drug_id: i for i, drug_id in enumerate(self.drug_ids)}
+        disease_rows = {disease_id: i for i, disease_id in enumerate(self.disease_ids)}
+        gen_rows = {gen_id: i for i, gen_id in enumerate(self.gen_ids)}
+        treatments = [(drug_rows[drug_id], disease_rows[disease_id]) for drug_id, disease_id in tables["Treatment"]
+                      if drug_id in drug_rows and disease_id in disease_rows]
+        self.treat_offsets, self.treat_diseases = _csr(treatments, len(drugs))
+        # Treatment has no key, a (drug, disease) pair can repeat and every copy joins
+        self.repeated_diseases = sorted({self.disease_names[d] for (r, d), (r2, d2) in zip(treatments, treatments[1:])
+                                         if (r, d) == (r2, d2)})
+        self.disease_offsets, self.disease_drugs = _csr(sorted(set((d, r) for r, d in treatments)), len(diseases))
+
+        alternatives = [(drug_rows[drug_id], gen_rows[gen_id]) for drug_id, gen_id in tables["DrugAlt"]
+                        if drug_id in drug_rows and gen_id in gen_rows]
+        alternatives.sort(key=lambda pair: (pair[0], self.gen_names[pair[1]], pair[1]))
+        self.alt_offsets, self.alt_gens = _csr(alternatives, len(drugs))
+
+        self.drug_by_name = array("q", sorted(range(len(drugs)), key=lambda i: (self.drug_names[i], i)))
+        self.drug_name_keys = [self.drug_names[i] for i in self.drug_by_name]
+        self.disease_by_name = array("q", sorted(range(len(diseases)), key=lambda i: (self.disease_names[i], i)))
+        self.disease_name_keys = [self.disease_names[i] for i in self.disease_by_name]
+
+        # what MultiDiseaseSummary holds, ordered by (DiseaseCount DESC, DrugID)
+        self.drug_diseases = [None] * len(drugs)
+        multi = []
+        for i in range(len(drugs)):
+            treated = self.treat_diseases[self.treat_offsets[i]:self.treat_offsets[i + 1]]
+            if not treated:
+                continue
+            self.drug_diseases[i] = ",".join(dict.fromkeys(self.disease_names[d] for d in treated))
+            if self.drug_manufacturers[i] is not None:
+                multi.append((self.drug_names[i], self.drug_ids[i], len(set(treated)), self.drug_diseases[i],
+                              self.drug_manufacturers[i], _price(self.drug_prices[i])))
+        multi.sort(key=lambda row: (-row[2], row[1]))
+        self.multi = multi
+        self.multi_keys = [(-row[2], row[1]) for row in multi]
+
+        self.counts = {table: len(rows) for table, rows in tables.items()}
+
+    def _alternatives(self, i):
+        return self.alt_gens[self.alt_offsets[i]:self.alt_offsets[i + 1]]
+
+    def _candidates(self, rows, after_id):
+        candidates = [i for i in rows if self.drug_ids[i] >= after_id and self.drug_manufacturers[i] is not None]
+        heapq.heapify(candidates)
+        return candidates
+
+    def drug_search(self, num, filter, after=None):
+        low, high = prefix_range(filter)
+        after = after or (num, None)
+        start = bisect.bisect_left(self.drug_name_keys, low)
+        end = bisect.bisect_left(self.drug_name_keys, high)
+        candidates = self._candidates(self.drug_by_name[start:end], after[0])
+        rows = []
+        while candidates:
+            i = heapq.heappop(candidates)
+            diseases = self.drug_diseases[i]
+            if diseases is None:
+                continue
+            drug_id, seen = self.drug_ids[i], set()
+            for g in self._alternatives(i):
+                gen_name = self.gen_names[g]
+                # grouped by g.Name, generics sharing a name make one row
+                if gen_name in seen or not _after((drug_id, gen_name), after):
+                    continue
+                seen.add(gen_name)
+                rows.append((self.drug_names[i], drug_id, self.gen_ids[g], diseases, _price(self.gen_prices[g]),
+                             _price(self.drug_prices[i]), gen_name))
+                if len(rows) == sql.PAGE_SIZE:
+                    return rows
+        return rows
+
+    def disease_search(self, num, filter, after=None):
+        low, high = prefix_range(filter)
+        after = after or (num, None, None)
+        start = bisect.bisect_left(self.disease_name_keys, low)
+        end = bisect.bisect_left(self.disease_name_keys, high)
+        matched = set(self.disease_by_name[start:end])
+        # each disease's drug list is sorted, merging them lazily yields drugs in id order
+        # without collecting every drug of every matched disease first
+        first = bisect.bisect_left(self.drug_ids, after[0])
+        postings = []
+        for d in matched:
+            low, high = self.disease_offsets[d], self.disease_offsets[d + 1]
+            low = bisect.bisect_left(self.disease_drugs, first, low, high)
+            postings.append(map(self.disease_drugs.__getitem__, range(low, high)))
+        candidates = heapq.merge(*postings)
+        rows, previous = [], -1
+        for i in candidates:
+            if i == previous or self.drug_manufacturers[i] is None:
+                continue
+            previous = i
+            drug_id = self.drug_ids[i]
+            # treat_diseases is in disease id order, a repeated Treatment row is adjacent copies:
+            # each generic comes once per copy, ahead of the next generic name
+            treated = self.treat_diseases[self.treat_offsets[i]:self.treat_offsets[i + 1]]
+            for d, copies in collections.Counter(treated).items():
+                if d not in matched:
+                    continue
+                for g in self._alternatives(i):
+                    if not _after((drug_id, self.disease_ids[d], self.gen_names[g]), after):
+                        continue
+                    row = (self.gen_names[g], self.disease_ids[d], _price(self.gen_prices[g]),
+                           _price(self.drug_prices[i]), drug_id, self.disease_names[d], self.drug_names[i])
+                    for _ in range(copies):
+                        rows.append(row)
+                        if len(rows) == sql.PAGE_SIZE:
+                            return rows
+        return rows
+
+    def multi_disease_search(self, num, min_diseases=2, after=None):
+        if after is None:
+            start, matches = 0, lambda row: row[1] > num
+        else:
+            count, drug_id = after
+            start, matches = bisect.bisect_right(self.multi_keys, (-count, drug_id)), lambda row: True
+        rows = []
+        for row in map(self.multi.__getitem__, range(start, len(self.multi))):
+            if row[2] < min_diseases:
+                break
+            if matches(row):
+                rows.append(row)
+                if len(rows) == sql.PAGE_SIZE:
+                    break
+        return rows
+
+
+# search name -> (catalog method, key of a page's last row used as the next page's after)
+SEARCHES = {
+    "Drug_Search_Mode_six": ("drug_search", lambda row: (row[1], row[6])),
+    "Disease_Search_Mode_six": ("disease_search", lambda row: (row[4], row[1], row[0])),
+    "Multi_Disease_Treatment_Search": ("multi_disease_search", lambda row: (row[2], row[1])),
+}
+
+
+def _comparable(name, rows):
+    # GROUP_CONCAT order is not defined, disease lists are compared as sets
+    column = {"Drug_Search_Mode_six": 3, "Multi_Disease_Treatment_Search": 3}.get(name)
+    if column is None:
+        return [tuple(row) for row in rows]
+    return [tuple(row[:column]) + (sorted((row[column] or "").split(",")),) + tuple(row[column + 1:])
+            for row in rows]
+
+
+class catalog_snapshot:
+    """
+    Optional in-memory copy of the catalog (config.SNAPSHOT) that answers the drug, disease and
+    multi-disease searches without SQLite, which stays the source of truth.
+    A write only marks the snapshot stale and wakes a background reload, until the reload
+    has caught up every search returns None so the caller falls back to SQL.
+    """
+
+    def __init__(self, reload_delay=config.SNAPSHOT_RELOAD_DELAY):
+        self.reload_delay = reload_delay
+        self.catalog = None
+        self.generation = 0
+        self.loaded_generation = -1
+        self.wake = threading.Event()
+        self.loaded = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+        self.loads = 0
+        self.last_load_seconds = 0.0
+        self.served = 0
+        self.fallbacks = 0
+
+    def load(self, db):
+        generation = self.generation
+        start = time.perf_counter()
+        loaded = catalog(db.dev_read_catalog())
+        with self.loaded:
+            self.catalog = loaded
+            self.loaded_generation = generation
+            self.loaded.notify_all()
+        self.loads += 1
+        self.last_load_seconds = time.perf_counter() - start
+
+    def start(self, db):
+        self.load(db)
+        self.thread = threading.Thread(target=self._reload_loop, args=(db,), name="drugbase-snapshot", daemon=True)
+        self.thread.start()
+
+    def _reload_loop(self, db):
+        while True:
+            self.wake.wait()
+            if self.stopped:
+                return
+            # lets a burst of writes settle first, bulk inserts notify once per row
+            time.sleep(self.reload_delay)
+            self.wake.clear()
+            try:
+                self.load(db)
+            except Exception:
+                log.exception("snapshot reload failed, searches fall back to sql")
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+
+    def on_write(self, table, action, row):
+        if table in sql.CATALOG_QUERIES or table == "*":
+            self.generation += 1
+            self.wake.set()
+
+    def fresh(self):
+        return self.catalog is not None and self.loaded_generation == self.generation
+
+    def search(self, name, *args):
+        """
+        Rows of the sql.database search called name, or None when the snapshot is stale
+        """
+        if not self.fresh():
+            self.fallbacks += 1
+            return None
+        self.served += 1
+        return getattr(self.catalog, SEARCHES[name][0])(*args)
+
+    def check(self, db, drug_prefixes=None, disease_prefixes=None, max_pages=50, timeout=None):
+        """
+        Runs the searches against both the snapshot and SQL, page by page, and returns
+        {"checked": pages compared, "mismatches": [...]}.
+        Prefixes default to every first letter in the catalog plus the empty prefix, and the
+        full name of every disease with a repeated Treatment row.
+        Waits up to timeout for a pending reload, a snapshot still stale then (or written to
+        during the check) raises RuntimeError instead of reporting the write as mismatches.
+        """
+        if timeout is None:
+            timeout = self.reload_delay + 30
+        with self.loaded:
+            if not self.loaded.wait_for(self.fresh, timeout):
+                raise RuntimeError("snapshot is stale, the reload after the last write has not finished")
+            generation, data = self.loaded_generation, self.catalog
+        if drug_prefixes is None:
+            drug_prefixes = [""] + sorted({name[:1] for name in data.drug_names})
+        if disease_prefixes is None:
+            disease_prefixes = [""] + sorted({name[:1] for name in data.disease_names}) + data.repeated_diseases
+        calls = ([("Drug_Search_Mode_six", (0, prefix)) for prefix in drug_prefixes] +
+                 [("Disease_Search_Mode_six", (0, prefix)) for prefix in disease_prefixes] +
+                 [("Multi_Disease_Treatment_Search", (0, count)) for count in range(1, 6)])
+
+        checked, mismatches = 0, []
+        for name, args in calls:
+            method, key = SEARCHES[name]
+            after = None
+            for _ in range(max_pages):
+                expected = getattr(db, name)(*args, after)
+                got = getattr(data, method)(*args, after)
+                checked += 1
+                if _comparable(name, expected) != _comparable(name, got):
+                    mismatches.append({"search": name, "args": list(args), "after": after,
+                                       "sql": expected, "snapshot": got})
+                    break
+                if len(expected) < sql.PAGE_SIZE:
+                    break
+                after = key(expected[-1])
+        if self.generation != generation:
+            raise RuntimeError("the catalog was written during the check, run it again")
+        return {"checked": checked, "mismatches": mismatches}
+
+    def stats(self):
+        return {
+            "loaded": self.catalog is not None,
+            "fresh": self.fresh(),
+            "loads": self.loads,
+            "last_load_ms": round(self.last_load_seconds * 1000, 2),
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "rows": self.catalog.counts if self.catalog is not None else {},
+        }
+
+
+def main():
+    #TO RUN (from server/):
+    #python3 snapshot.py [path to db, defaults to config.DB_PATH]
+    #compares every search answered from the snapshot with the same search in sql
+    path = sys.argv[1] if len(sys.argv) > 1 else config.DB_PATH
+    db = sql.database(path)
+    snapshot = catalog_snapshot()
+    snapshot.load(db)
+    print("loaded in %.1f ms: %s" % (snapshot.last_load_seconds * 1000, snapshot.catalog.counts))
+    result = snapshot.check(db)
+    for mismatch in result["mismatches"]:
+        print("MISMATCH", mismatch)
+    print("%d pages compared, %d mismatches" % (result["checked"], len(result["mismatches"])))
+    sys.exit(1 if result["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
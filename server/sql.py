@@ -1,34 +1,138 @@
+import functools
+import logging
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-class database:
-    def __init__(self):
-        self.db = sqlite3.connect("fake.db")
-        
-    def Multi_Disease_Treatment_Search(self, num, min_diseases=2):
-        """
-        Find drugs that treat multiple diseases using HAVING clause
-        This query finds drugs that treat at least min_diseases different diseases
-        """
-        cur = self.db.cursor()
-        cur.execute("""
-        SELECT nbd.Name, nbd.DrugID, COUNT(DISTINCT d.DiseaseID) as disease_count, 
-               GROUP_CONCAT(DISTINCT d.Name) as diseases, 
-               m.Name as manufacturer, nbd.price
+import config
+from instrument import query_instrument
+from migrations import migrate, prefix_range, validate_schema
+from pool import connection_pool
+from savings import rebuild_disease_savings, rebuild_drug_savings, refresh_drug_savings
+from summary import rebuild_multi_disease_summary, refresh_multi_disease_summary, rename_manufacturer_in_summary
+
+log = logging.getLogger(__name__)
+
+# bound parameters per IN (...) list, well under sqlite's variable limit
+IN_CHUNK = 500
+
+
+def chunked(values, size=IN_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def publishes_version(method):
+    # a dev_* write moves the data version only after its notifications went out
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._publish_data_version()
+    return wrapper
+
+# tables each cached read depends on, a write to any of them invalidates its cached results
+SEARCH_TABLES = ("Manufacturer", "NBDrugs", "Treatment", "DrugAlt", "Generics", "Disease")
+MULTI_DISEASE_TABLES = ("Manufacturer", "NBDrugs", "Treatment", "Disease", "MultiDiseaseSummary")
+DESCRIPTION_TABLES = ("NBDrugs",)
+SAVINGS_TABLES = ("NBDrugs", "Treatment", "DrugAlt", "Generics", "Disease", "DrugSavings", "DiseaseSavings")
+
+# rows per page of every search, a full page means there may be another one
+PAGE_SIZE = 8
+
+MULTI_DISEASE_SEARCH = """
+        SELECT Name, DrugID, DiseaseCount AS disease_count, Diseases AS diseases,
+               Manufacturer AS manufacturer, Price
+        FROM MultiDiseaseSummary
+        WHERE DrugID > ? AND DiseaseCount >= ?
+        ORDER BY DiseaseCount DESC, DrugID ASC
+        LIMIT %d""" % PAGE_SIZE
+
+# continues after the (disease_count, DrugID) of the previous page's last row
+MULTI_DISEASE_SEARCH_AFTER = """
+        SELECT Name, DrugID, DiseaseCount AS disease_count, Diseases AS diseases,
+               Manufacturer AS manufacturer, Price
+        FROM MultiDiseaseSummary
+        WHERE DiseaseCount >= ? AND DiseaseCount <= ?
+          AND (DiseaseCount < ? OR (DiseaseCount = ? AND DrugID > ?))
+        ORDER BY DiseaseCount DESC, DrugID ASC
+        LIMIT %d""" % PAGE_SIZE
+
+# best alternative of every drug treating the disease, biggest saving first, read in
+# DiseaseSavings primary key order
+TOP_SAVINGS = """
+        SELECT nbd.Name AS DrugName, s.DrugID, g.Name AS GenName, s.GenID, s.DrugPrice, s.GenPrice,
+               s.Savings, s.SavingsPct
+        FROM DiseaseSavings AS s
+        JOIN NBDrugs AS nbd ON nbd.DrugID = s.DrugID
+        JOIN Generics AS g ON g.GenID = s.GenID
+        WHERE s.DiseaseName = ?
+        ORDER BY s.Savings DESC, s.DrugID ASC
+        LIMIT %d""" % PAGE_SIZE
+
+# continues after the (Savings, DrugID) of the previous page's last row
+TOP_SAVINGS_AFTER = """
+        SELECT nbd.Name AS DrugName, s.DrugID, g.Name AS GenName, s.GenID, s.DrugPrice, s.GenPrice,
+               s.Savings, s.SavingsPct
+        FROM DiseaseSavings AS s
+        JOIN NBDrugs AS nbd ON nbd.DrugID = s.DrugID
+        JOIN Generics AS g ON g.GenID = s.GenID
+        WHERE s.DiseaseName = ? AND s.Savings <= ?
+          AND (s.Savings < ? OR s.DrugID > ?)
+        ORDER BY s.Savings DESC, s.DrugID ASC
+        LIMIT %d""" % PAGE_SIZE
+
+CHEAPEST_ALTERNATIVES = """
+        SELECT nbd.Name AS DrugName, s.DrugID, g.Name AS GenName, s.GenID, s.DrugPrice, s.GenPrice,
+               s.Savings, s.SavingsPct, s.Rank
         FROM NBDrugs AS nbd
-        JOIN Treatment AS t ON t.DrugID = nbd.DrugID
-        JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
-        JOIN Manufacturer AS m ON m.ManID = nbd.ManID
-        WHERE nbd.DrugID > ?
-        GROUP BY nbd.DrugID
-        HAVING COUNT(DISTINCT d.DiseaseID) >= ?
-        ORDER BY disease_count DESC, nbd.DrugID ASC
-        LIMIT 8""", (num, min_diseases))
-        results = cur.fetchall()
-        cur.close()
-        return results
-    def Drug_Search_Mode_six(self, num, filter):
-        cur = self.db.cursor() 
-        cur.execute("""
+        JOIN DrugSavings AS s ON s.DrugID = nbd.DrugID
+        JOIN Generics AS g ON g.GenID = s.GenID
+        WHERE nbd.Name = ? AND s.Rank <= ?
+        ORDER BY s.DrugID ASC, s.Rank ASC"""
+
+# table name used by the export endpoints -> (table, id column, columns that may be selected)
+EXPORT_TABLES = {
+    "manufacturers": ("Manufacturer", "ManID", ("ManID", "Name")),
+    "drugs": ("NBDrugs", "DrugID", ("DrugID", "Name", "Price", "Purpose", "ManID")),
+    "generics": ("Generics", "GenID", ("GenID", "Name", "Price", "Purpose")),
+    "diseases": ("Disease", "DiseaseID", ("DiseaseID", "Name")),
+}
+
+DESCRIPTION = "SELECT Purpose FROM NBDrugs WHERE Name = ?"
+
+# what the in-memory snapshot (snapshot.py) loads, ordered the way it indexes them
+CATALOG_QUERIES = {
+    "Manufacturer": "SELECT ManID, Name FROM Manufacturer",
+    "NBDrugs": "SELECT DrugID, Name, Price, ManID FROM NBDrugs ORDER BY DrugID",
+    "Generics": "SELECT GenID, Name, Price FROM Generics ORDER BY GenID",
+    "Disease": "SELECT DiseaseID, Name FROM Disease ORDER BY DiseaseID",
+    "Treatment": "SELECT DrugID, DiseaseID FROM Treatment ORDER BY DrugID, DiseaseID",
+    "DrugAlt": "SELECT DrugID, GenID FROM DrugAlt ORDER BY DrugID, GenID",
+}
+
+# %s is the column and placeholder list filled in by Get_Drug_Details
+DRUG_DETAILS = """
+        SELECT nbd.DrugID, nbd.Name, nbd.Price, nbd.Purpose, g.GenID, g.Name, g.Price
+        FROM NBDrugs AS nbd
+        LEFT JOIN DrugAlt AS da ON da.DrugID = nbd.DrugID
+        LEFT JOIN Generics AS g ON g.GenID = da.GenID
+        WHERE nbd.%s IN (%s)
+        ORDER BY nbd.DrugID, g.Price"""
+
+# Name prefixes are matched as a range so the planner can seek idx_nbdrugs_name /
+# idx_disease_name instead of scanning with substr().
+# Pages are keyed on the full sort key, (DrugID, gName) and (DrugID, DiseaseID, GenName),
+# so drugs with several rows are never cut in half between pages. A NULL in the
+# key's tail (the legacy IDFrom form) means "after every row of that DrugID".
+DRUG_SEARCH = """
         SELECT 
             nbd.Name AS name,
             nbd.DrugID AS drugID,
@@ -43,17 +147,12 @@ class database:
         JOIN DrugAlt as da ON da.DrugID = t.DrugID
         JOIN Generics AS g ON da.GenID = g.GenID
         JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
-        WHERE substr(nbd.Name, 1, ?) = ? AND nbd.DrugID > ?
+        WHERE nbd.Name >= ? AND nbd.Name < ? AND (nbd.DrugID, g.Name) > (?, ?)
         GROUP BY nbd.DrugID, g.Name, m.Name
-        ORDER BY nbd.DrugID ASC
-        LIMIT 8""",  (len(filter), filter, num))
-        results = cur.fetchall()
-        
-        cur.close()
-        return results
-    def Disease_Search_Mode_six(self, num, filter):
-        cur = self.db.cursor() 
-        cur.execute("""SELECT 
+        ORDER BY nbd.DrugID ASC, g.Name ASC
+        LIMIT %d""" % PAGE_SIZE
+
+DISEASE_SEARCH = """SELECT 
                     g.Name AS GenName,
                     d.DiseaseID,
                     g.price AS Gprice,
@@ -67,124 +166,503 @@ class database:
                     JOIN DrugAlt as da ON da.DrugID = t.DrugID
                     JOIN Generics AS g ON da.GenID = g.GenID
                     JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
-                    WHERE substr(d.Name, 1, ?) = ? AND nbd.DrugID > ?
-                    ORDER BY nbd.DrugID ASC
-                    LIMIT 8""", (len(filter), filter, num))
-        results = cur.fetchall()
-        cur.close()
+                    WHERE d.Name >= ? AND d.Name < ?
+                      AND (nbd.DrugID, d.DiseaseID, g.Name) > (?, ?, ?)
+                    ORDER BY nbd.DrugID ASC, d.DiseaseID ASC, g.Name ASC
+                    LIMIT %d""" % PAGE_SIZE
+
+# run once on every read connection at startup so their prepared forms are in each
+# connection's statement cache, the params match nothing so this costs a seek per query
+WARM_STATEMENTS = [
+    (MULTI_DISEASE_SEARCH, (0, 1 << 62)),
+    (MULTI_DISEASE_SEARCH_AFTER, (1 << 62, 0, 0, 0, 0)),
+    (DRUG_SEARCH, ("\U0010ffff", "\U0010ffff", 0, None)),
+    (DISEASE_SEARCH, ("\U0010ffff", "\U0010ffff", 0, None, None)),
+    (TOP_SAVINGS, ("",)),
+    (TOP_SAVINGS_AFTER, ("", 0, 0, 0)),
+    (CHEAPEST_ALTERNATIVES, ("", 1)),
+    (DESCRIPTION, ("",)),
+]
+
+# walk the indexes and tables the searches read, so their pages are in the OS cache (and mapped,
+# with PRAGMA mmap_size) before the first request needs them
+PRE_READS = [
+    "SELECT COUNT(Name) FROM NBDrugs INDEXED BY idx_nbdrugs_name",
+    "SELECT COUNT(Name) FROM Disease INDEXED BY idx_disease_name",
+    "SELECT COUNT(*) FROM Treatment INDEXED BY idx_treatment_drugid",
+    "SELECT COUNT(*) FROM Treatment INDEXED BY idx_treatment_diseaseid",
+    "SELECT COUNT(*) FROM DrugAlt INDEXED BY idx_drugalt_drugid",
+    "SELECT COUNT(*) FROM MultiDiseaseSummary INDEXED BY idx_multi_disease_count",
+    "SELECT COUNT(Savings) FROM DrugSavings",
+    "SELECT COUNT(Savings) FROM DiseaseSavings",
+    "SELECT COUNT(Price) FROM NBDrugs NOT INDEXED",
+    "SELECT COUNT(Price) FROM Generics NOT INDEXED",
+    "SELECT COUNT(Name) FROM Manufacturer NOT INDEXED",
+]
+
+class database:
+    def __init__(self, path=config.DB_PATH, pool_size=config.READ_POOL_SIZE, instrument=config.INSTRUMENT):
+        self.path = path
+        # None keeps the query path free of any timing work
+        self.instrument = query_instrument() if instrument else None
+        self.timed_cursor = self.instrument.cursor_class() if instrument else None
+        # reads are spread over read-only connections, every dev_* write
+        # goes through the pool's single writer
+        # sqlite would create an empty file and every query would fail later instead
+        if not os.path.exists(path):
+            raise FileNotFoundError("database %s does not exist, set DRUGBASE_DB_PATH" % os.path.abspath(path))
+        self.pool = connection_pool(path, pool_size)
+        with self.pool.write() as conn:
+            validate_schema(conn)
+            self.schema_version = migrate(conn)
+        self.listeners = []
+        self.data_version = self.committed_version = self._read_data_version()
+        self.watch_stopped = threading.Event()
+
+    def subscribe(self, listener):
+        """
+        Registers listener(table, action, row) to be called after every committed write,
+        so in-process indexes and caches can follow the data.
+        table is "*" when another process wrote to the file and what changed is unknown.
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, table, action, row):
+        for listener in self.listeners:
+            try:
+                listener(table, action, row)
+            except Exception:
+                log.exception("write listener %r failed for %s %s", listener, action, table)
+
+    def _fetchall(self, query, params=(), name="query"):
+        with self.pool.read() as conn:
+            if self.instrument is None:
+                cur = conn.cursor()
+                cur.execute(query, params)
+                results = cur.fetchall()
+                cur.close()
+                return results
+
+            start = time.perf_counter()
+            try:
+                cur = conn.cursor()
+                cur.execute(query, params)
+                results = cur.fetchall()
+                cur.close()
+            except sqlite3.Error:
+                self.instrument.errors.inc((name,))
+                raise
+            self.instrument.record(name, query, params, time.perf_counter() - start, len(results), conn)
         return results
 
+    @contextmanager
+    def _write(self, name):
+        """
+        Cursor inside the pool's write transaction, timed as name when instrumented.
+        Bumps the persisted data version in the same transaction, so it moves
+        exactly when the committed data does.
+        """
+        with self.pool.write() as conn:
+            cur = self._cursor(conn, name)
+            try:
+                yield cur
+                before = cur.execute("SELECT Version FROM DataVersion").fetchone()[0]
+                cur.execute("UPDATE DataVersion SET Version = ?", (before + 1,))
+                # still under the write lock: no other local write, and no version check reading
+                # after the commit, can see this bump before committed_version covers it
+                known = max(self.data_version, self.committed_version)
+                self.committed_version = max(self.committed_version, before + 1)
+            finally:
+                cur.close()
+        if before > known:
+            # another process wrote since the last check, this write's bump would hide it
+            self._notify("*", "external", {"Version": before})
+
+    def _publish_data_version(self):
+        self.data_version = max(self.data_version, self.committed_version)
+
+    def current_data_version(self):
+        """
+        Version of the catalog data, for ETags. A write from this process moves it once the
+        write's listeners have run, so nothing tagged with the new version is read from a stale cache.
+        Writes from other processes show up once check_data_version has seen them.
+        Never touches the database, so the middlewares can call it on the event loop.
+        """
+        return self.data_version
+
+    def check_data_version(self):
+        """
+        Re-reads the persisted version to notice writes from other processes (other workers,
+        populateDB --incremental), listeners are then told with a ("*", "external") notification.
+        """
+        persisted = self._read_data_version()
+        if persisted > max(self.data_version, self.committed_version):
+            self._notify("*", "external", {"Version": persisted})
+            self.data_version = persisted
+
+    def watch_data_version(self, interval=config.DATA_VERSION_CHECK_INTERVAL):
+        """
+        Runs check_data_version every interval seconds on a background thread until close(),
+        the read can wait on the pool there without holding up any request.
+        """
+        def watch():
+            while not self.watch_stopped.wait(interval):
+                try:
+                    self.check_data_version()
+                except Exception:
+                    log.exception("data version check failed")
+
+        threading.Thread(target=watch, name="drugbase-data-version", daemon=True).start()
+
+    def close(self):
+        self.watch_stopped.set()
+        self.pool.close()
+
+    def _read_data_version(self):
+        with self.pool.read() as conn:
+            return conn.execute("SELECT Version FROM DataVersion").fetchone()[0]
+
+    def _cursor(self, conn, name):
+        """
+        Cursor for a write block, every statement on it is timed as name when instrumented.
+        """
+        if self.instrument is None:
+            return conn.cursor()
+        cur = conn.cursor(self.timed_cursor)
+        cur.query_name = name
+        return cur
+
+    def Multi_Disease_Treatment_Search(self, num, min_diseases=2, after=None):
+        """
+        Find drugs that treat at least min_diseases different diseases
+        Reads the precomputed MultiDiseaseSummary table, so this is an index seek on
+        (DiseaseCount DESC, DrugID) instead of aggregating all of Treatment
+        after is the (disease_count, DrugID) of the previous page's last row
+        """
+        if after is None:
+            return self._fetchall(MULTI_DISEASE_SEARCH, (num, min_diseases), name="Multi_Disease_Treatment_Search")
+        count, drug_id = after
+        return self._fetchall(MULTI_DISEASE_SEARCH_AFTER, (min_diseases, count, count, count, drug_id),
+                              name="Multi_Disease_Treatment_Search")
+
+    def Drug_Search_Mode_six(self, num, filter, after=None):
+        """
+        after is the (drugID, gName) of the previous page's last row, num alone
+        starts after every row of drug num
+        """
+        low, high = prefix_range(filter)
+        drug_id, gen_name = after or (num, None)
+        return self._fetchall(DRUG_SEARCH, (low, high, drug_id, gen_name), name="Drug_Search_Mode_six")
+    def Disease_Search_Mode_six(self, num, filter, after=None):
+        """
+        after is the (drugID, DiseaseID, GenName) of the previous page's last row
+        """
+        low, high = prefix_range(filter)
+        drug_id, disease_id, gen_name = after or (num, None, None)
+        return self._fetchall(DISEASE_SEARCH, (low, high, drug_id, disease_id, gen_name), name="Disease_Search_Mode_six")
+
+    def Top_Savings_For_Disease(self, diseaseName, after=None):
+        """
+        Drugs treating diseaseName with their cheapest generic, biggest saving first
+        after is the (Savings, DrugID) of the previous page's last row
+        """
+        if after is None:
+            return self._fetchall(TOP_SAVINGS, (diseaseName,), name="Top_Savings_For_Disease")
+        savings, drug_id = after
+        return self._fetchall(TOP_SAVINGS_AFTER, (diseaseName, savings, savings, drug_id),
+                              name="Top_Savings_For_Disease")
+
+    def Cheapest_Alternatives(self, drugName, count=1):
+        """
+        The count cheapest generics of every drug called drugName, ranked per drug
+        """
+        return self._fetchall(CHEAPEST_ALTERNATIVES, (drugName, count), name="Cheapest_Alternatives")
+
     def Get_Description_Drug(self, drugName):
-        cur = self.db.cursor()
-        cur.execute(
-            """
-            SELECT Purpose FROM NBDrugs WHERE Name = ?; 
-            """, 
-            (drugName,)
-        ) 
-        results = cur.fetchall()
-        cur.close()
+        return self._fetchall(DESCRIPTION, (drugName,), name="Get_Description_Drug")
+
+    def Get_Description_Drugs(self, drugNames):
+        """
+        Batch form of Get_Description_Drug, {name: [(Purpose,), ...]} for every requested name
+        """
+        results = {name: [] for name in drugNames}
+        for chunk in chunked(list(results)):
+            rows = self._fetchall("SELECT Name, Purpose FROM NBDrugs WHERE Name IN (%s)" % placeholders(chunk),
+                                  chunk, name="Get_Description_Drugs")
+            for drug_name, purpose in rows:
+                results[drug_name].append((purpose,))
         return results
 
+    def Get_Drug_Details(self, drugNames=(), drugIDs=()):
+        """
+        Description, price and generic alternatives of many drugs in one round trip
+        Returns ({name: [drug, ...]}, {id: drug or None}) keyed by what was asked for
+        """
+        by_name = {name: [] for name in drugNames}
+        by_id = {drug_id: None for drug_id in drugIDs}
+        for column, keys in (("Name", list(by_name)), ("DrugID", list(by_id))):
+            drugs = {}
+            for chunk in chunked(keys):
+                rows = self._fetchall(DRUG_DETAILS % (column, placeholders(chunk)), chunk, name="Get_Drug_Details")
+                for drug_id, drug_name, price, purpose, gen_id, gen_name, gen_price in rows:
+                    drug = drugs.get(drug_id)
+                    if drug is None:
+                        drug = drugs[drug_id] = {"drugID": drug_id, "name": drug_name, "price": price,
+                                                 "purpose": purpose, "alternatives": []}
+                        if column == "Name":
+                            by_name[drug_name].append(drug)
+                        else:
+                            by_id[drug_id] = drug
+                    if gen_id is not None and all(alt["genID"] != gen_id for alt in drug["alternatives"]):
+                        drug["alternatives"].append({"genID": gen_id, "name": gen_name, "price": gen_price})
+        return by_name, by_id
+
 
+    @publishes_version
     def dev_insert_manufacturer(self, name):
-        cur = self.db.cursor()
-        cur.execute("SELECT MAX(ManID) FROM Manufacturer")
-        max_id = cur.fetchone()[0]
-        new_id = 1 if max_id is None else max_id + 1
-        
-        cur.execute("INSERT INTO Manufacturer (ManID, Name) VALUES (?, ?)", 
-                   (new_id, name))
-        self.db.commit()
-        cur.close()
+        with self._write("dev_insert_manufacturer") as cur:
+            # ManID is an INTEGER PRIMARY KEY (migration v3), sqlite picks the next id
+            cur.execute("INSERT INTO Manufacturer (Name) VALUES (?)", (name,))
+            new_id = cur.lastrowid
+        self._notify("Manufacturer", "insert", {"ManID": new_id, "Name": name})
         return new_id
 
+    @publishes_version
     def dev_insert_drug(self, name, price, purpose, man_id):
-        cur = self.db.cursor()
-        cur.execute("SELECT MAX(DrugID) FROM NBDrugs")
-        max_id = cur.fetchone()[0]
-        new_id = 1 if max_id is None else max_id + 1
-        
-        cur.execute("""
-            INSERT INTO NBDrugs (DrugID, Name, Price, Purpose, ManID) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (new_id, name, price, purpose, man_id))
-        self.db.commit()
-        cur.close()
+        with self._write("dev_insert_drug") as cur:
+            cur.execute("""
+                INSERT INTO NBDrugs (Name, Price, Purpose, ManID) 
+                VALUES (?, ?, ?, ?)
+            """, (name, price, purpose, man_id))
+            new_id = cur.lastrowid
+        self._notify("NBDrugs", "insert", {"DrugID": new_id, "Name": name, "Price": price,
+                                           "Purpose": purpose, "ManID": man_id})
         return new_id
 
+    @publishes_version
     def dev_insert_generic(self, name, price, purpose):
-        cur = self.db.cursor()
-        cur.execute("SELECT MAX(GenID) FROM Generics")
-        max_id = cur.fetchone()[0]
-        new_id = 1 if max_id is None else max_id + 1
-        
-        cur.execute("""
-            INSERT INTO Generics (GenID, Name, Price, Purpose) 
-            VALUES (?, ?, ?, ?)
-        """, (new_id, name, price, purpose))
-        self.db.commit()
-        cur.close()
+        with self._write("dev_insert_generic") as cur:
+            cur.execute("""
+                INSERT INTO Generics (Name, Price, Purpose) 
+                VALUES (?, ?, ?)
+            """, (name, price, purpose))
+            new_id = cur.lastrowid
+        self._notify("Generics", "insert", {"GenID": new_id, "Name": name, "Price": price, "Purpose": purpose})
         return new_id
 
+    @publishes_version
     def dev_insert_treatment(self, disease_id, drug_id, gen_id):
-        cur = self.db.cursor()
-        cur.execute("""
-            INSERT INTO Treatment (DiseaseID, DrugID) 
-            VALUES (?, ?)
-        """, (disease_id, drug_id))
-        cur.execute("INSERT INTO DrugAlt (DrugID, GenID) VALUES (?,?)", (drug_id, gen_id))
-        self.db.commit()
-        cur.close()
+        with self._write("dev_insert_treatment") as cur:
+            cur.execute("""
+                INSERT INTO Treatment (DiseaseID, DrugID) 
+                VALUES (?, ?)
+            """, (disease_id, drug_id))
+            cur.execute("INSERT INTO DrugAlt (DrugID, GenID) VALUES (?,?)", (drug_id, gen_id))
+            refresh_multi_disease_summary(cur, drug_id)
+            refresh_drug_savings(cur, drug_id)
+        self._notify("Treatment", "insert", {"DiseaseID": disease_id, "DrugID": drug_id})
+        self._notify("DrugAlt", "insert", {"DrugID": drug_id, "GenID": gen_id})
         return True
 
+    @publishes_version
+    def _bulk_insert(self, name, table, id_col, columns, rows):
+        """
+        Inserts rows (tuples matching columns) with one executemany in one transaction.
+        Ids are handed out from the current MAX(id), a rowid seek rather than a scan,
+        and the BEGIN IMMEDIATE in pool.write keeps other writers out until the commit.
+        Returns the new ids in input order.
+        """
+        with self._write(name) as cur:
+            max_id = cur.execute("SELECT MAX(%s) FROM %s" % (id_col, table)).fetchone()[0] or 0
+            ids = list(range(max_id + 1, max_id + 1 + len(rows)))
+            cur.executemany("INSERT INTO %s (%s, %s) VALUES (%s)" % (table, id_col, ", ".join(columns),
+                                                                  placeholders(columns + [id_col])),
+                            [(new_id,) + tuple(row) for new_id, row in zip(ids, rows)])
+        for new_id, row in zip(ids, rows):
+            self._notify(table, "insert", dict(zip([id_col] + columns, (new_id,) + tuple(row))))
+        return ids
+
+    def dev_bulk_insert_manufacturers(self, names):
+        return self._bulk_insert("dev_bulk_insert_manufacturers", "Manufacturer", "ManID", ["Name"],
+                                 [(name,) for name in names])
+
+    def dev_bulk_insert_drugs(self, drugs):
+        """
+        drugs are (name, price, purpose, man_id) tuples
+        """
+        return self._bulk_insert("dev_bulk_insert_drugs", "NBDrugs", "DrugID", ["Name", "Price", "Purpose", "ManID"],
+                                 drugs)
+
+    def dev_bulk_insert_generics(self, generics):
+        """
+        generics are (name, price, purpose) tuples
+        """
+        return self._bulk_insert("dev_bulk_insert_generics", "Generics", "GenID", ["Name", "Price", "Purpose"],
+                                 generics)
+
+    @publishes_version
+    def dev_bulk_insert_treatments(self, treatments):
+        """
+        treatments are (disease_id, drug_id, gen_id) tuples, like dev_insert_treatment
+        Links that already exist in DrugAlt are kept once
+        """
+        drug_ids = sorted({drug_id for _, drug_id, _ in treatments})
+        with self._write("dev_bulk_insert_treatments") as cur:
+            cur.executemany("INSERT INTO Treatment (DiseaseID, DrugID) VALUES (?, ?)",
+                            [(disease_id, drug_id) for disease_id, drug_id, _ in treatments])
+            cur.executemany("""
+                INSERT INTO DrugAlt (DrugID, GenID) SELECT ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM DrugAlt WHERE DrugID = ? AND GenID = ?)
+            """, [(drug_id, gen_id, drug_id, gen_id) for _, drug_id, gen_id in treatments])
+            for drug_id in drug_ids:
+                refresh_multi_disease_summary(cur, drug_id)
+                refresh_drug_savings(cur, drug_id)
+        for disease_id, drug_id, gen_id in treatments:
+            self._notify("Treatment", "insert", {"DiseaseID": disease_id, "DrugID": drug_id})
+            self._notify("DrugAlt", "insert", {"DrugID": drug_id, "GenID": gen_id})
+        return len(treatments)
+
+    def dev_iter_table(self, export, columns=None, name_prefix=None, min_price=None, max_price=None,
+                       batch_size=config.EXPORT_BATCH_SIZE):
+        """
+        Yields lists of up to batch_size rows of an EXPORT_TABLES table in id order,
+        read with fetchmany so memory stays flat whatever the table size.
+        The read connection is held until the generator is exhausted or closed.
+        Raises ValueError for an unknown table, column or filter.
+        """
+        if export not in EXPORT_TABLES:
+            raise ValueError("unknown table %r" % export)
+        table, id_col, allowed = EXPORT_TABLES[export]
+        columns = list(columns or allowed)
+        unknown = [column for column in columns if column not in allowed]
+        if unknown:
+            raise ValueError("unknown columns for %s: %s" % (export, ", ".join(unknown)))
+
+        where, params = [], []
+        if name_prefix:
+            low, high = prefix_range(name_prefix)
+            where.append("Name >= ? AND Name < ?")
+            params += [low, high]
+        if min_price is not None or max_price is not None:
+            if "Price" not in allowed:
+                raise ValueError("%s has no Price column" % export)
+            if min_price is not None:
+                where.append("Price >= ?")
+                params.append(min_price)
+            if max_price is not None:
+                where.append("Price <= ?")
+                params.append(max_price)
+        query = "SELECT %s FROM %s%s ORDER BY %s" % (", ".join(columns), table,
+                                                     " WHERE " + " AND ".join(where) if where else "", id_col)
+        return self._iter_batches(query, params, batch_size, "dev_iter_table")
+
+    def _iter_batches(self, query, params, batch_size, name):
+        with self.pool.stream() as conn:
+            start = time.perf_counter()
+            rows = 0
+            cur = conn.cursor()
+            try:
+                cur.execute(query, params)
+                while True:
+                    batch = cur.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    rows += len(batch)
+                    yield batch
+            finally:
+                cur.close()
+                if self.instrument is not None:
+                    self.instrument.latency.observe((name,), time.perf_counter() - start)
+                    self.instrument.rows.inc((name,), rows)
+
     def dev_get_all_manufacturers(self):
-        cur = self.db.cursor()
-        cur.execute("SELECT * FROM Manufacturer ORDER BY ManID")
-        results = cur.fetchall()
-        cur.close()
-        return results
+        return self._fetchall("SELECT * FROM Manufacturer ORDER BY ManID", name="dev_get_all_manufacturers")
 
     def dev_get_all_diseases(self):
-        cur = self.db.cursor()
-        cur.execute("SELECT * FROM Disease ORDER BY DiseaseID")
-        results = cur.fetchall()
-        cur.close()
-        return results
+        return self._fetchall("SELECT * FROM Disease ORDER BY DiseaseID", name="dev_get_all_diseases")
 
     def dev_get_all_drugs(self):
-        cur = self.db.cursor()
-        cur.execute("SELECT DrugID, Name FROM NBDrugs ORDER BY DrugID")
-        results = cur.fetchall()
-        cur.close()
-        return results
+        return self._fetchall("SELECT DrugID, Name FROM NBDrugs ORDER BY DrugID", name="dev_get_all_drugs")
 
     def dev_get_all_generics(self):
-        cur = self.db.cursor()
-        cur.execute("SELECT GenID, Name FROM Generics ORDER BY GenID")
-        results = cur.fetchall()
-        cur.close()
-        return results
+        return self._fetchall("SELECT GenID, Name FROM Generics ORDER BY GenID", name="dev_get_all_generics")
 
+    def dev_read_catalog(self):
+        """
+        Every catalog table as {table: rows}, read in one transaction so the tables agree
+        with each other. Used to load the in-memory snapshot.
+        """
+        with self.pool.read() as conn:
+            start = time.perf_counter()
+            conn.execute("BEGIN")
+            try:
+                tables = {table: conn.execute(query).fetchall() for table, query in CATALOG_QUERIES.items()}
+            finally:
+                conn.execute("COMMIT")
+            if self.instrument is not None:
+                self.instrument.latency.observe(("dev_read_catalog",), time.perf_counter() - start)
+                self.instrument.rows.inc(("dev_read_catalog",), sum(len(rows) for rows in tables.values()))
+        return tables
+
+    @publishes_version
     def dev_update_manufacturer_name(self, man_id, new_name):
-        cur = self.db.cursor()
-        cur.execute("UPDATE Manufacturer SET Name = ? WHERE ManID = ?", 
-                   (new_name, man_id))
-        self.db.commit()
-        cur.close()
+        with self._write("dev_update_manufacturer_name") as cur:
+            cur.execute("UPDATE Manufacturer SET Name = ? WHERE ManID = ?", 
+                       (new_name, man_id))
+            rename_manufacturer_in_summary(cur, man_id, new_name)
+        self._notify("Manufacturer", "update", {"ManID": man_id, "Name": new_name})
         return True
 
+    @publishes_version
     def dev_delete_drug_cascade(self, drug_id):
-        cur = self.db.cursor()
-        
-        cur.execute("DELETE FROM Treatment WHERE DrugID = ?", (drug_id,))
-        cur.execute("DELETE FROM DrugAlt WHERE DrugID = ?", (drug_id,))
-        cur.execute("DELETE FROM NBDrugs WHERE DrugID = ?", (drug_id,))
-
-        self.db.commit()
-        cur.close()
+        with self._write("dev_delete_drug_cascade") as cur:
+
+            cur.execute("DELETE FROM Treatment WHERE DrugID = ?", (drug_id,))
+            cur.execute("DELETE FROM DrugAlt WHERE DrugID = ?", (drug_id,))
+            cur.execute("DELETE FROM NBDrugs WHERE DrugID = ?", (drug_id,))
+            cur.execute("DELETE FROM MultiDiseaseSummary WHERE DrugID = ?", (drug_id,))
+            cur.execute("DELETE FROM DrugSavings WHERE DrugID = ?", (drug_id,))
+            cur.execute("DELETE FROM DiseaseSavings WHERE DrugID = ?", (drug_id,))
+
+        self._notify("Treatment", "delete", {"DrugID": drug_id})
+        self._notify("DrugAlt", "delete", {"DrugID": drug_id})
+        self._notify("NBDrugs", "delete", {"DrugID": drug_id})
         return True
 
-test = database()
-print(test.Drug_Search_Mode_six(0,"Acu"))
-print(test.Disease_Search_Mode_six(0, "Arthritis"))
+    @publishes_version
+    def dev_rebuild_multi_disease_summary(self):
+        with self._write("dev_rebuild_multi_disease_summary") as cur:
+            count = rebuild_multi_disease_summary(cur)
+        self._notify("MultiDiseaseSummary", "rebuild", {})
+        return count
+
+    @publishes_version
+    def dev_rebuild_drug_savings(self):
+        with self._write("dev_rebuild_drug_savings") as cur:
+            count = rebuild_drug_savings(cur)
+            rebuild_disease_savings(cur)
+        self._notify("DrugSavings", "rebuild", {})
+        return count
+
+    def warm_up(self):
+        """
+        Prepares WARM_STATEMENTS on every read connection and runs PRE_READS,
+        returns what was done and how long it took.
+        """
+        start = time.perf_counter()
+        connections = self.pool.warm(WARM_STATEMENTS)
+        prepared = time.perf_counter()
+        with self.pool.read() as conn:
+            for query in PRE_READS:
+                conn.execute(query).fetchall()
+        return {"connections": connections, "statements": len(WARM_STATEMENTS), "pre_reads": len(PRE_READS),
+                "prepare_ms": round((prepared - start) * 1000, 2),
+                "pre_read_ms": round((time.perf_counter() - prepared) * 1000, 2)}
+
+    def dev_pool_health(self):
+        return {"pool": self.pool.stats(), "health": self.pool.health_check()}
+
+if __name__ == "__main__":
+    test = database()
+    print(test.Drug_Search_Mode_six(0,"Acu"))
+    print(test.Disease_Search_Mode_six(0, "Arthritis"))
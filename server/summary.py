@@ -0,0 +1,43 @@
+"""
+MultiDiseaseSummary keeps, per drug, what Multi_Disease_Treatment_Search used to aggregate on every request.
+It is kept current inside the same transaction as the dev_* write that changes it.
+"""
+
+SUMMARY_SELECT = """
+    SELECT nbd.DrugID, nbd.Name, COUNT(DISTINCT d.DiseaseID), GROUP_CONCAT(DISTINCT d.Name),
+           m.Name, nbd.Price
+    FROM NBDrugs AS nbd
+    JOIN Treatment AS t ON t.DrugID = nbd.DrugID
+    JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
+    JOIN Manufacturer AS m ON m.ManID = nbd.ManID
+"""
+
+
+def create_multi_disease_summary(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS MultiDiseaseSummary (
+            DrugID INTEGER PRIMARY KEY,
+            Name TEXT,
+            DiseaseCount INTEGER NOT NULL,
+            Diseases TEXT,
+            Manufacturer TEXT,
+            Price INTEGER
+            )""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_multi_disease_count
+            ON MultiDiseaseSummary (DiseaseCount DESC, DrugID)""")
+
+
+def rebuild_multi_disease_summary(cur):
+    cur.execute("DELETE FROM MultiDiseaseSummary")
+    cur.execute("INSERT INTO MultiDiseaseSummary " + SUMMARY_SELECT + " GROUP BY nbd.DrugID")
+    return cur.execute("SELECT COUNT(*) FROM MultiDiseaseSummary").fetchone()[0]
+
+
+def refresh_multi_disease_summary(cur, drug_id):
+    cur.execute("DELETE FROM MultiDiseaseSummary WHERE DrugID = ?", (drug_id,))
+    cur.execute("INSERT INTO MultiDiseaseSummary " + SUMMARY_SELECT + " WHERE nbd.DrugID = ? GROUP BY nbd.DrugID",
+                (drug_id,))
+
+
+def rename_manufacturer_in_summary(cur, man_id, new_name):
+    cur.execute("""UPDATE MultiDiseaseSummary SET Manufacturer = ?
+            WHERE DrugID IN (SELECT DrugID FROM NBDrugs WHERE ManID = ?)""", (new_name, man_id))
@@ -1,55 +1,74 @@
-import sqlite3
-
-class database:
-    def __init__(self):
-        self.db = sqlite3.connect("fake.db")
-        self.last = -1  # This will hold the last thing for implementing search
-
-    def Drug_Search_Mode_six(self, num, filter):
-        cur = self.db.cursor()
-        lenOfFilter = len(filter)
-        cur.execute(
-            """SELECT nbd.DrugID, g.Name, d.Name, m.Name 
-               FROM Manufacturer AS m
-               JOIN NBDrugs AS nbd ON m.ManID = nbd.ManID
-               JOIN Treatment AS t ON t.DrugID = nbd.DrugID
-               JOIN Generics AS g ON t.GenID = g.GenID
-               JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
-               WHERE substr(g.Name, 1, ?) = ? AND nbd.DrugID > ?
-               ORDER BY nbd.DrugID ASC
-               LIMIT 6""",
-            (lenOfFilter, filter, num)
-        )
-        results = cur.fetchall()
-        cur.close()
-        return results
-
-    def Disease_Search_Mode_six(self, num, filter):
-        cur = self.db.cursor()
-        lenOfFilter = len(filter)
-        cur.execute(
-            """SELECT nbd.DrugID, g.Name, d.Name, m.Name 
-               FROM Manufacturer AS m
-               JOIN NBDrugs AS nbd ON m.ManID = nbd.ManID
-               JOIN Treatment AS t ON t.DrugID = nbd.DrugID
-               JOIN Generics AS g ON t.GenID = g.GenID
-               JOIN Disease AS d ON d.DiseaseID = t.DiseaseID
-               WHERE substr(d.Name, 1, ?) = ? AND nbd.DrugID > ?
-               ORDER BY nbd.DrugID ASC
-               LIMIT 6""",
-            (lenOfFilter, filter, num)
-        )
-        results = cur.fetchall()
-        cur.close()
-        return results
-
-
-test = database()
-
-
-drug_results = test.Drug_Search_Mode_six(0, "Generic")
-print("Drug search results:", drug_results)
-
-
-disease_results = test.Disease_Search_Mode_six(0, "Flu")
-print("Disease search results:", disease_results)
+import sys
+
+import config
+import rows
+import sql
+
+#TO RUN (from server/):
+#python3 testsql.py [path to db, defaults to config.DB_PATH]
+
+#Checks that the search queries seek the indexes added by migrations.py
+#instead of scanning every row, then prints a couple of sample searches
+
+
+def query_plan(db, query, params):
+    with db.pool.read() as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def check_index_search(db, label, query, params, index):
+    steps = query_plan(db, query, params)
+    scans = [step for step in steps if step.startswith("SCAN")]
+    assert any(index in step for step in steps), "%s does not use %s: %s" % (label, index, steps)
+    assert not scans, "%s scans a table: %s" % (label, scans)
+    print("ok  %s uses %s" % (label, index))
+
+
+def check_row_model(db, label, query, params, model):
+    with db.pool.read() as conn:
+        cur = conn.execute(query, params)
+        columns = tuple(column[0] for column in cur.description)
+        cur.close()
+    assert columns == model._fields, "%s returns %s, %s expects %s" % (label, columns, model.__name__, model._fields)
+    print("ok  %s rows match %s" % (label, model.__name__))
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else config.DB_PATH
+    test = sql.database(path)
+
+    check_index_search(test, "Drug_Search_Mode_six", sql.DRUG_SEARCH,
+                       ("Acu", "Acv", 0, None), "idx_nbdrugs_name")
+    check_index_search(test, "Disease_Search_Mode_six", sql.DISEASE_SEARCH,
+                       ("Flu", "Flv", 0, None, None), "idx_disease_name")
+
+    for label, query, params in (("", sql.MULTI_DISEASE_SEARCH, (0, 2)),
+                                 (" after cursor", sql.MULTI_DISEASE_SEARCH_AFTER, (2, 4, 4, 4, 10))):
+        steps = query_plan(test, query, params)
+        assert any("idx_multi_disease_count" in step for step in steps), steps
+        assert not any("TEMP B-TREE" in step for step in steps), steps
+        print("ok  Multi_Disease_Treatment_Search%s uses idx_multi_disease_count" % label)
+
+    for label, query, params in (("", sql.TOP_SAVINGS, ("Flu",)),
+                                 (" after cursor", sql.TOP_SAVINGS_AFTER, ("Flu", 20, 20, 10))):
+        steps = query_plan(test, query, params)
+        assert any("s USING PRIMARY KEY (DiseaseName=?" in step for step in steps), steps
+        assert not any("TEMP B-TREE" in step for step in steps), steps
+        print("ok  Top_Savings_For_Disease%s uses the DiseaseSavings primary key" % label)
+    check_index_search(test, "Cheapest_Alternatives", sql.CHEAPEST_ALTERNATIVES,
+                       ("Acustat", 1), "PRIMARY KEY (DrugID=? AND Rank<?)")
+
+    for label, query, params, model in (
+            ("Drug_Search_Mode_six", sql.DRUG_SEARCH, ("Acu", "Acv", 0, None), rows.DrugSearchRow),
+            ("Disease_Search_Mode_six", sql.DISEASE_SEARCH, ("Flu", "Flv", 0, None, None), rows.DiseaseSearchRow),
+            ("Multi_Disease_Treatment_Search", sql.MULTI_DISEASE_SEARCH, (0, 2), rows.MultiDiseaseRow),
+            ("Top_Savings_For_Disease", sql.TOP_SAVINGS, ("Flu",), rows.SavingsRow),
+            ("Cheapest_Alternatives", sql.CHEAPEST_ALTERNATIVES, ("Acustat", 1), rows.AlternativeRow)):
+        check_row_model(test, label, query, params, model)
+
+    print("Drug search results:", test.Drug_Search_Mode_six(0, "Acu"))
+    print("Disease search results:", test.Disease_Search_Mode_six(0, "Flu"))
+
+
+if __name__ == "__main__":
+    main()